@@ -1,53 +1,69 @@
 import pandas as pd
+import numpy as np
 import json
-from groq import Groq
+import asyncio
+import threading
+import time
+import itertools
+import groq
 import os
 from dotenv import load_dotenv
+from data_loader import canonical_customer_id, get_customer_index
+from report_cache import get_report_cache, ReportCache
+from metrics import observe_llm_call
+from llm_scheduler import get_llm_scheduler, report_priority
 
 load_dotenv()
 
+def _to_float(value):
+    # Missing and unparseable values count as 0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if np.isnan(value) else value
+
+def _format_date(value):
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d') if value == value.normalize() else value.isoformat()
+    if pd.isna(value):
+        return ''
+    return str(value)
+
 # --- Customer Context Agent ---
 def customer_context_agent(customer_id, customer_data):
     # Ensure customer_id is string and normalize
-    customer_id = str(customer_id).strip().upper()
+    customer_id = canonical_customer_id(customer_id)
     
-    customer_records = customer_data[customer_data['Customer_ID'].astype(str).str.strip().str.upper() == customer_id]
-    if customer_records.empty:
+    index = get_customer_index(customer_data)
+    code = index.code(customer_id)
+    if code < 0:
         return None
     
-    customer_info = customer_records.iloc[0]
+    # Customer attributes come from the customer's first record; spend and
+    # products from its purchase rows
+    customer_info = index.customer_record(customer_id)
+    customer_records = index.customer_purchases(customer_id)
     
-    # Ensure numeric columns are properly handled
-    try:
-        total_spent = customer_records['Total_Price(USD)'].astype(float).sum()
-        avg_order_value = customer_records['Total_Price(USD)'].astype(float).mean()
-    except:
+    # Columns are typed by the loader; frames read without it are converted here
+    prices = customer_records['Total_Price(USD)']
+    if not pd.api.types.is_numeric_dtype(prices):
+        prices = pd.to_numeric(prices, errors='coerce')
+    prices = prices.astype(float)
+    if prices.notna().any():
+        total_spent = prices.sum()
+        avg_order_value = prices.mean()
+    else:
         total_spent = 0
         avg_order_value = 0
     
     purchase_frequency = len(customer_records)
     products_purchased = customer_records['Product'].unique().tolist()
     
-    # Handle potential data issues
-    try:
-        annual_revenue = float(customer_info['Annual_Revenue(USD)'])
-    except:
-        annual_revenue = 0
-    
-    try:
-        employees = int(customer_info['Number_of_Employees'])
-    except:
-        employees = 0
-    
-    try:
-        product_usage = float(customer_info['Product_Usage(%)'])
-    except:
-        product_usage = 0
-    
-    try:
-        opportunity_amount = float(customer_info['Opportunity_Amount(USD)'])
-    except:
-        opportunity_amount = 0
+    annual_revenue = _to_float(customer_info['Annual_Revenue(USD)'])
+    employees = int(_to_float(customer_info['Number_of_Employees']))
+    product_usage = _to_float(customer_info['Product_Usage(%)'])
+    opportunity_amount = _to_float(customer_info['Opportunity_Amount(USD)'])
     
     profile = {
         "customer_id": customer_id,
@@ -64,7 +80,7 @@ def customer_context_agent(customer_id, customer_data):
         "avg_order_value": avg_order_value,
         "purchase_frequency": purchase_frequency,
         "products_purchased": products_purchased,
-        "last_activity": str(customer_info['Last_Activity_Date']),
+        "last_activity": _format_date(customer_info['Last_Activity_Date']),
         "opportunity_stage": str(customer_info['Opportunity_Stage']),
         "opportunity_amount": opportunity_amount,
         "competitors": str(customer_info['Competitors'])
@@ -72,106 +88,325 @@ def customer_context_agent(customer_id, customer_data):
     return profile
 
 # --- Purchase Pattern Analysis Agent ---
-def purchase_pattern_agent(customer_profile, all_customer_data):
+def purchase_pattern_agent(customer_profile, all_customer_data, lookalikes=None):
+    """
+    Products common in the customer's industry that it has not bought.
+    With `lookalikes` set to a number of neighbors, products bought by the
+    customer's nearest lookalike customers (any industry) are also checked
+    for gaps and added to the missing opportunities.
+    """
     customer_products = customer_profile['products_purchased']
-    customer_id = customer_profile['customer_id'].strip().upper()
-    similar_customers = all_customer_data[
-        (all_customer_data['Industry'] == customer_profile['industry']) &
-        (all_customer_data['Customer_ID'].astype(str).str.strip().str.upper() != customer_id)
-    ]
-    all_products = similar_customers['Product'].value_counts()
+    customer_id = customer_profile['customer_id']
+    index = get_customer_index(all_customer_data)
+    aggregates = index.aggregates
+    all_products, total_industry_customers = aggregates.industry_product_counts(
+        customer_profile['industry'], exclude_customer=customer_id
+    )
     frequent_products = all_products.head(10).index.tolist()
     missing_products = [p for p in frequent_products if p not in customer_products]
+    product_counts = aggregates.customer_product_counts(customer_id)
     customer_product_frequency = {
-        product: len(all_customer_data[(all_customer_data['Customer_ID'].astype(str).str.strip().str.upper() == customer_id) & (all_customer_data['Product'] == product)])
+        product: product_counts.get(product, 0)
         for product in customer_products
     }
-    return {
+    pattern = {
         "frequent_products_industry": frequent_products,
         "missing_opportunities": missing_products,
         "customer_product_frequency": customer_product_frequency,
-        "total_industry_customers": len(similar_customers['Customer_ID'].unique())
+        "total_industry_customers": total_industry_customers
     }
+    if lookalikes:
+        similarity = index.similarity
+        neighbors = similarity.neighbors(customer_id, lookalikes)
+        lookalike_products = similarity.product_counts(neighbors.index).head(10).index.tolist()
+        lookalike_missing = [p for p in lookalike_products if p not in customer_products]
+        pattern["lookalike_customers"] = neighbors.index.tolist()
+        pattern["lookalike_opportunities"] = lookalike_missing
+        pattern["missing_opportunities"] = missing_products + [p for p in lookalike_missing if p not in missing_products]
+    return pattern
 
 # --- Product Affinity Agent ---
 def product_affinity_agent(customer_profile, all_customer_data):
     customer_products = customer_profile['products_purchased']
-    customer_id = customer_profile['customer_id'].strip().upper()
-    similar_purchases = all_customer_data[all_customer_data['Product'].isin(customer_products)]
-    related_customers = similar_purchases['Customer_ID'].unique()
+    cooccurrence = get_customer_index(all_customer_data).cooccurrence
     product_affinities = {}
     for product in customer_products:
-        product_customers = all_customer_data[all_customer_data['Product'] == product]['Customer_ID'].unique()
-        co_purchased = all_customer_data[all_customer_data['Customer_ID'].isin(product_customers)]['Product'].value_counts()
+        co_purchased = cooccurrence.co_purchase_counts(product)
         co_purchased = co_purchased.drop(customer_products, errors='ignore')
         product_affinities[product] = co_purchased.head(5).to_dict()
-    all_co_purchased = all_customer_data[all_customer_data['Customer_ID'].isin(related_customers)]['Product'].value_counts()
+    all_co_purchased, related_customer_count = cooccurrence.related_purchase_counts(customer_products)
     recommendations = all_co_purchased.drop(customer_products, errors='ignore').head(10)
     return {
         "product_affinities": product_affinities,
         "top_recommendations": recommendations.to_dict(),
-        "related_customer_count": len(related_customers)
+        "related_customer_count": related_customer_count
     }
 
 # --- Opportunity Scoring Agent ---
+# Rules shared by the per-customer and batch scoring paths, as (weight, reason)
+HIGH_REVENUE_THRESHOLD = 100000000
+FREQUENT_PURCHASER_THRESHOLD = 5
+LOW_USAGE_THRESHOLD = 80
+LOW_FREQUENCY_THRESHOLD = 3
+ACTIVE_OPPORTUNITY_STAGES = ['Prospecting', 'Qualification']
+MIN_UPSELL_SCORE = 0.3
+
+CROSS_SELL_RULES = [
+    (0.3, "Frequently purchased in industry"),
+    (0.2, "High co-purchase affinity"),
+    (0.2, "High priority customer"),
+    (0.15, "High revenue potential"),
+    (0.15, "Frequent purchaser"),
+]
+
+UPSELL_RULES = [
+    (0.3, "Low product usage indicates expansion opportunity"),
+    (0.2, "Low purchase frequency suggests upsell potential"),
+    (0.2, "High priority customer"),
+    (0.15, "High revenue potential"),
+    (0.15, "Active opportunity stage"),
+]
+
+def _apply_rules(rules, conditions):
+    score = 0.0
+    reason = []
+    for (weight, label), condition in zip(rules, conditions):
+        if condition:
+            score += weight
+            reason.append(label)
+    return score, "; ".join(reason)
+
 def opportunity_scoring_agent(customer_profile, pattern_analysis, affinity_analysis):
     opportunities = []
     for product in pattern_analysis['missing_opportunities']:
-        score = 0.0
-        reason = []
-        if product in pattern_analysis['frequent_products_industry']:
-            score += 0.3
-            reason.append("Frequently purchased in industry")
-        if product in affinity_analysis['top_recommendations']:
-            score += 0.2
-            reason.append("High co-purchase affinity")
-        if customer_profile['priority_rating'] == 'High':
-            score += 0.2
-            reason.append("High priority customer")
-        if customer_profile['annual_revenue'] > 100000000:
-            score += 0.15
-            reason.append("High revenue potential")
-        if customer_profile['purchase_frequency'] > 5:
-            score += 0.15
-            reason.append("Frequent purchaser")
+        score, reason = _apply_rules(CROSS_SELL_RULES, [
+            product in pattern_analysis['frequent_products_industry'],
+            product in affinity_analysis['top_recommendations'],
+            customer_profile['priority_rating'] == 'High',
+            customer_profile['annual_revenue'] > HIGH_REVENUE_THRESHOLD,
+            customer_profile['purchase_frequency'] > FREQUENT_PURCHASER_THRESHOLD,
+        ])
         opportunities.append({
             "product": product,
             "type": "Cross-sell",
             "score": min(score, 1.0),
-            "reason": "; ".join(reason)
+            "reason": reason
         })
     for product in customer_profile['products_purchased']:
         current_frequency = pattern_analysis['customer_product_frequency'].get(product, 0)
         if current_frequency > 0:
-            score = 0.0
-            reason = []
-            if customer_profile['product_usage'] < 80:
-                score += 0.3
-                reason.append("Low product usage indicates expansion opportunity")
-            if current_frequency < 3:
-                score += 0.2
-                reason.append("Low purchase frequency suggests upsell potential")
-            if customer_profile['priority_rating'] == 'High':
-                score += 0.2
-                reason.append("High priority customer")
-            if customer_profile['annual_revenue'] > 100000000:
-                score += 0.15
-                reason.append("High revenue potential")
-            if customer_profile['opportunity_stage'] in ['Prospecting', 'Qualification']:
-                score += 0.15
-                reason.append("Active opportunity stage")
-            if score > 0.3:
+            score, reason = _apply_rules(UPSELL_RULES, [
+                customer_profile['product_usage'] < LOW_USAGE_THRESHOLD,
+                current_frequency < LOW_FREQUENCY_THRESHOLD,
+                customer_profile['priority_rating'] == 'High',
+                customer_profile['annual_revenue'] > HIGH_REVENUE_THRESHOLD,
+                customer_profile['opportunity_stage'] in ACTIVE_OPPORTUNITY_STAGES,
+            ])
+            if score > MIN_UPSELL_SCORE:
                 opportunities.append({
                     "product": f"{product} (Expansion)",
                     "type": "Upsell",
                     "score": min(score, 1.0),
-                    "reason": "; ".join(reason)
+                    "reason": reason
                 })
     opportunities.sort(key=lambda x: x['score'], reverse=True)
     return opportunities
 
+# --- Batch Opportunity Scoring ---
+def _float_column(values):
+    """_to_float over a whole column, without the per-value call when it is already numeric"""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.fillna(0).to_numpy(dtype=float)
+    return values.map(_to_float).to_numpy(dtype=float)
+
+def _apply_rules_vectorized(rules, conditions):
+    """Array version of _apply_rules: one element per candidate"""
+    score = np.zeros(len(conditions[0]))
+    combo = np.zeros(len(conditions[0]), dtype=np.int64)
+    for bit, ((weight, _), condition) in enumerate(zip(rules, conditions)):
+        # Adding 0.0 for unmet rules keeps scores bit-identical to the scalar path
+        score = score + np.where(condition, weight, 0.0)
+        combo |= np.asarray(condition, dtype=np.int64) << bit
+    reasons = np.array([
+        "; ".join(label for bit, (_, label) in enumerate(rules) if c >> bit & 1)
+        for c in range(2 ** len(rules))
+    ], dtype=object)
+    return score, reasons[combo]
+
+def score_all_customers(customer_data, customer_ids=None):
+    """
+    Score cross-sell and upsell opportunities for many customers at once.
+
+    Candidate products are ranked for the whole batch at once from the
+    precomputed pattern and affinity indexes, and the scoring rules are
+    evaluated as array operations over the customer x candidate table.
+    Returns one row per opportunity (customer_id, product, type, score,
+    reason), each customer's rows in the order opportunity_scoring_agent
+    would return them.
+    """
+    index = get_customer_index(customer_data)
+    aggregates = index.aggregates
+    cooccurrence = index.cooccurrence
+    if customer_ids is None:
+        codes = np.arange(len(index))
+    else:
+        codes = np.array([index.code(c) for c in customer_ids], dtype=np.int64)
+        codes = codes[codes >= 0]
+
+    # Customer-level inputs, read from each customer's first record like the profile
+    first_rows = index.customer_attributes(codes)
+    ids = np.array(index.customer_ids, dtype=object)[codes]
+    high_priority = first_rows['Customer_Priority_Rating'].astype(str).to_numpy() == 'High'
+    high_revenue = _float_column(first_rows['Annual_Revenue(USD)']) > HIGH_REVENUE_THRESHOLD
+    low_usage = _float_column(first_rows['Product_Usage(%)']) < LOW_USAGE_THRESHOLD
+    active_stage = first_rows['Opportunity_Stage'].astype(str).isin(ACTIVE_OPPORTUNITY_STAGES).to_numpy()
+    frequent_purchaser = np.diff(index.offsets)[codes] > FREQUENT_PURCHASER_THRESHOLD
+
+    # Products each customer bought, in first-purchase order, with row counts
+    product_codes, products = pd.factorize(customer_data['Product'])
+    products = np.asarray(products.astype(object))
+    n_products = max(len(products), 1)
+    row_product = product_codes[index.order]
+    row_customer = index.row_codes[index.order]
+    valid = row_product >= 0
+    keys = row_customer[valid].astype(np.int64) * n_products + row_product[valid]
+    keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    by_purchase = np.lexsort((first, keys // n_products))
+    owned_customer = (keys // n_products)[by_purchase]
+    owned_product = (keys % n_products)[by_purchase]
+    owned_count = counts[by_purchase]
+    owned_offsets = np.concatenate(([0], np.cumsum(np.bincount(owned_customer, minlength=len(index)))))
+
+    # Cross-sell candidates: industry favourites the customer lacks, flagged
+    # when they also rank among the co-purchase recommendations. Industry
+    # rankings are computed for the whole batch as a matrix of product codes;
+    # the co-purchase ranking is only tested for the missing favourites.
+    frequent = aggregates.industry_top_products(codes, 10)
+    owned = aggregates.owned_products(codes)
+    rows = np.arange(len(codes))[:, None]
+    missing = (frequent >= 0) & ~owned[rows, np.maximum(frequent, 0)]
+    # Co-occurrence products are coded separately; map between them by name
+    to_cooccurrence = cooccurrence.products.get_indexer(aggregates.products)
+    known = to_cooccurrence >= 0
+    lacking = np.flatnonzero(missing.any(axis=1))
+    owned_cooccurrence = np.zeros((len(lacking), len(cooccurrence.products)), dtype=bool)
+    owned_cooccurrence[:, to_cooccurrence[known]] = owned[lacking][:, known]
+    candidates = np.where(missing[lacking], to_cooccurrence[np.maximum(frequent[lacking], 0)], -1)
+    affinity = np.zeros(missing.shape, dtype=bool)
+    affinity[lacking] = cooccurrence.in_top_related_products(owned_cooccurrence, candidates, 10)
+
+    cross_customer, slot = np.nonzero(missing)
+    cross_product = np.asarray(aggregates.products, dtype=object)[frequent[cross_customer, slot]]
+    cross_affinity = affinity[cross_customer, slot]
+    cross_score, cross_reason = _apply_rules_vectorized(CROSS_SELL_RULES, [
+        # Missing products are drawn from the industry favourites
+        np.ones(len(cross_customer), dtype=bool),
+        cross_affinity,
+        high_priority[cross_customer],
+        high_revenue[cross_customer],
+        frequent_purchaser[cross_customer],
+    ])
+
+    # Upsell candidates: every product the customer already buys
+    lengths = owned_offsets[codes + 1] - owned_offsets[codes]
+    up_customer = np.repeat(np.arange(len(codes)), lengths)
+    up_idx = np.repeat(owned_offsets[codes] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    up_score, up_reason = _apply_rules_vectorized(UPSELL_RULES, [
+        low_usage[up_customer],
+        owned_count[up_idx] < LOW_FREQUENCY_THRESHOLD,
+        high_priority[up_customer],
+        high_revenue[up_customer],
+        active_stage[up_customer],
+    ])
+    keep = up_score > MIN_UPSELL_SCORE
+    up_customer, up_idx, up_score, up_reason = up_customer[keep], up_idx[keep], up_score[keep], up_reason[keep]
+
+    scores = pd.DataFrame({
+        'customer_id': ids[np.concatenate([cross_customer, up_customer])],
+        'product': np.concatenate([
+            cross_product,
+            np.array([f"{p} (Expansion)" for p in products[owned_product[up_idx]]], dtype=object),
+        ]),
+        'type': ['Cross-sell'] * len(cross_customer) + ['Upsell'] * len(up_customer),
+        'score': np.minimum(np.concatenate([cross_score, up_score]), 1.0),
+        'reason': np.concatenate([cross_reason, up_reason]),
+    })
+    # Highest score first within each customer; ties keep cross-sell before
+    # upsell and candidate order, like the stable sort in the scalar agent
+    customer_position = np.concatenate([cross_customer, up_customer])
+    order = np.lexsort((np.arange(len(scores)), -scores['score'].to_numpy(), customer_position))
+    return scores.take(order).reset_index(drop=True)
+
+def opportunities_by_customer(scores):
+    """Group score_all_customers output into per-customer opportunity lists"""
+    return {
+        customer_id: group.drop(columns='customer_id').to_dict('records')
+        for customer_id, group in scores.groupby('customer_id', sort=False)
+    }
+
 # --- Recommendation Report Agent ---
-def recommendation_report_agent(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities):
+REPORT_MODEL = "llama3-70b-8192"
+REPORT_TEMPERATURE = 0.7
+REPORT_SYSTEM_PROMPT = "You are a senior B2B sales analyst with expertise in customer analysis and opportunity identification."
+# Reports that failed are returned as this prefix plus the error
+REPORT_FAILURE_PREFIX = "Research report could not be generated"
+
+# Shared LLM clients: one long-lived client per process keeps its HTTP
+# connection pool warm instead of reconnecting on every report
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', '60'))
+# Completion size assumed when reserving tokens-per-minute budget
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv('LLM_EXPECTED_COMPLETION_TOKENS', '1024'))
+
+_groq_client = None
+_async_groq_client = None
+_client_lock = threading.Lock()
+
+def get_groq_client():
+    """Shared synchronous Groq client, created on first use"""
+    global _groq_client
+    with _client_lock:
+        if _groq_client is None:
+            import httpx
+            _groq_client = groq.Groq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                timeout=LLM_TIMEOUT_SECONDS,
+                # Retries go through the LLM scheduler instead
+                max_retries=0,
+                http_client=groq.DefaultHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                ),
+            )
+        return _groq_client
+
+def get_async_groq_client():
+    """Shared asynchronous Groq client, created on first use inside the event loop"""
+    global _async_groq_client
+    with _client_lock:
+        if _async_groq_client is None:
+            import httpx
+            _async_groq_client = groq.AsyncGroq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                timeout=LLM_TIMEOUT_SECONDS,
+                # Retries go through the LLM scheduler instead
+                max_retries=0,
+                http_client=groq.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                ),
+            )
+        return _async_groq_client
+
+async def close_llm_clients():
+    """Close the shared clients (call on application shutdown)"""
+    global _groq_client, _async_groq_client
+    if _async_groq_client is not None:
+        await _async_groq_client.close()
+        _async_groq_client = None
+    if _groq_client is not None:
+        _groq_client.close()
+        _groq_client = None
+
+def build_report_prompt(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities):
     # Ensure products_purchased contains only strings
     products_purchased_str = [str(product) for product in customer_profile['products_purchased']]
     
@@ -200,19 +435,382 @@ def recommendation_report_agent(customer_profile, pattern_analysis, affinity_ana
     6. Conclusion
     Make it business-focused and actionable.
     """
+    return prompt
+
+def _report_messages(prompt):
+    return [
+        {"role": "system", "content": REPORT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def _cached_report(prompt):
+    """Report cache, cache key and cached report (or None) for a prompt"""
+    cache = get_report_cache()
+    cache_key = ReportCache.make_key(REPORT_MODEL, {"temperature": REPORT_TEMPERATURE}, _report_messages(prompt))
+    cached = cache.get(cache_key) if cache is not None else None
+    return cache, cache_key, cached
+
+def _estimated_tokens(prompt):
+    # Roughly four characters per token, plus the expected completion
+    return (len(REPORT_SYSTEM_PROMPT) + len(prompt)) / 4 + LLM_EXPECTED_COMPLETION_TOKENS
+
+def _usage_tokens(response):
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None)
+
+def recommendation_report_agent(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                                interactive=True):
+    """
+    Generate the research report with the LLM. The call goes through the
+    process-wide LLM scheduler, queued by report_priority: interactive
+    requests and high-priority accounts first, batch work
+    (interactive=False) after them.
+    """
+    prompt = build_report_prompt(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    cache, cache_key, cached = _cached_report(prompt)
+    if cached is not None:
+        observe_llm_call('sync', 'cached', prompt)
+        return cached
+    
+    started = time.perf_counter()
+    try:
+        response = get_llm_scheduler().call(
+            lambda: get_groq_client().chat.completions.create(
+                model=REPORT_MODEL,
+                messages=_report_messages(prompt),
+                temperature=REPORT_TEMPERATURE,
+            ),
+            priority=report_priority(customer_profile, interactive),
+            estimated_tokens=_estimated_tokens(prompt),
+            usage_tokens=_usage_tokens,
+        )
+        report = response.choices[0].message.content
+        observe_llm_call('sync', 'success', prompt, time.perf_counter() - started, getattr(response, 'usage', None))
+        if cache is not None:
+            cache.set(cache_key, report)
+    except Exception as e:
+        observe_llm_call('sync', 'error', prompt, time.perf_counter() - started)
+        report = f"{REPORT_FAILURE_PREFIX}: {e}"
+    return report
+
+async def recommendation_report_agent_async(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                                            interactive=True):
+    """
+    Async variant of recommendation_report_agent for the API server. Uses the
+    shared pooled client and the same scheduler as the sync variant.
+    Both variants serve repeated prompts from the report cache; here its
+    SQLite reads and writes run in a worker thread, off the event loop.
+    """
+    prompt = build_report_prompt(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    cache, cache_key, cached = await asyncio.to_thread(_cached_report, prompt)
+    if cached is not None:
+        observe_llm_call('async', 'cached', prompt)
+        return cached
     
+    started = time.perf_counter()
     try:
-        from groq import Groq
-        client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[
-                {"role": "system", "content": "You are a senior B2B sales analyst with expertise in customer analysis and opportunity identification."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
+        response = await get_llm_scheduler().call_async(
+            lambda: get_async_groq_client().chat.completions.create(
+                model=REPORT_MODEL,
+                messages=_report_messages(prompt),
+                temperature=REPORT_TEMPERATURE,
+            ),
+            priority=report_priority(customer_profile, interactive),
+            estimated_tokens=_estimated_tokens(prompt),
+            usage_tokens=_usage_tokens,
         )
         report = response.choices[0].message.content
+        observe_llm_call('async', 'success', prompt, time.perf_counter() - started, getattr(response, 'usage', None))
+        if cache is not None:
+            await asyncio.to_thread(cache.set, cache_key, report)
     except Exception as e:
-        report = f"Research report could not be generated: {e}"
+        observe_llm_call('async', 'error', prompt, time.perf_counter() - started)
+        report = f"{REPORT_FAILURE_PREFIX}: {e}"
     return report
+
+def _delta_text(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+def _chunk_usage(chunk):
+    # Groq reports token usage on the last chunk of a stream
+    x_groq = getattr(chunk, 'x_groq', None)
+    return getattr(x_groq, 'usage', None) or getattr(chunk, 'usage', None)
+
+def stream_recommendation_report(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                                 interactive=True):
+    """
+    Generator variant of recommendation_report_agent: yields report text as
+    the model produces it. A cached report is yielded in one piece, and a
+    completed stream is added to the cache. The scheduler slot is held
+    until the stream ends; failures are retried only before any text was
+    yielded.
+    """
+    prompt = build_report_prompt(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    cache, cache_key, cached = _cached_report(prompt)
+    if cached is not None:
+        observe_llm_call('stream', 'cached', prompt)
+        yield cached
+        return
+    
+    scheduler = get_llm_scheduler()
+    parts = []
+    usage = None
+    started = time.perf_counter()
+    for attempt in itertools.count():
+        try:
+            with scheduler.reserve(report_priority(customer_profile, interactive), _estimated_tokens(prompt)) as reservation:
+                stream = get_groq_client().chat.completions.create(
+                    model=REPORT_MODEL,
+                    messages=_report_messages(prompt),
+                    temperature=REPORT_TEMPERATURE,
+                    stream=True,
+                )
+                for chunk in stream:
+                    usage = _chunk_usage(chunk) or usage
+                    text = _delta_text(chunk)
+                    if text:
+                        parts.append(text)
+                        yield text
+                reservation.used_tokens = getattr(usage, 'total_tokens', None)
+            observe_llm_call('stream', 'success', prompt, time.perf_counter() - started, usage)
+            if cache is not None:
+                cache.set(cache_key, "".join(parts))
+            return
+        except Exception as e:
+            delay = None if parts else scheduler.retry_delay(attempt, e)
+            if delay is None:
+                observe_llm_call('stream', 'error', prompt, time.perf_counter() - started)
+                separator = "\n\n" if parts else ""
+                yield f"{separator}{REPORT_FAILURE_PREFIX}: {e}"
+                return
+            time.sleep(delay)
+
+async def stream_recommendation_report_async(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                                             interactive=True):
+    """Async generator variant of stream_recommendation_report"""
+    prompt = build_report_prompt(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    cache, cache_key, cached = await asyncio.to_thread(_cached_report, prompt)
+    if cached is not None:
+        observe_llm_call('stream', 'cached', prompt)
+        yield cached
+        return
+    
+    scheduler = get_llm_scheduler()
+    parts = []
+    usage = None
+    started = time.perf_counter()
+    for attempt in itertools.count():
+        try:
+            async with scheduler.reserve_async(report_priority(customer_profile, interactive), _estimated_tokens(prompt)) as reservation:
+                stream = await get_async_groq_client().chat.completions.create(
+                    model=REPORT_MODEL,
+                    messages=_report_messages(prompt),
+                    temperature=REPORT_TEMPERATURE,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    usage = _chunk_usage(chunk) or usage
+                    text = _delta_text(chunk)
+                    if text:
+                        parts.append(text)
+                        yield text
+                reservation.used_tokens = getattr(usage, 'total_tokens', None)
+            observe_llm_call('stream', 'success', prompt, time.perf_counter() - started, usage)
+            if cache is not None:
+                await asyncio.to_thread(cache.set, cache_key, "".join(parts))
+            return
+        except Exception as e:
+            delay = None if parts else scheduler.retry_delay(attempt, e)
+            if delay is None:
+                observe_llm_call('stream', 'error', prompt, time.perf_counter() - started)
+                separator = "\n\n" if parts else ""
+                yield f"{separator}{REPORT_FAILURE_PREFIX}: {e}"
+                return
+            await asyncio.sleep(delay)
+
+# --- Template reports ---
+# How reports are produced: "template" renders the analysis locally, "llm"
+# asks the model, and "auto" asks the model but falls back to the template
+# when the answer takes longer than LLM_REPORT_BUDGET_SECONDS or fails
+REPORT_MODES = ("template", "llm", "auto")
+REPORT_MODE = os.getenv('REPORT_MODE', 'llm').strip().lower()
+if REPORT_MODE not in REPORT_MODES:
+    raise ValueError(f"REPORT_MODE must be one of {', '.join(REPORT_MODES)}, not {REPORT_MODE!r}")
+LLM_REPORT_BUDGET_SECONDS = float(os.getenv('LLM_REPORT_BUDGET_SECONDS', '8'))
+
+def _money(value):
+    return f"${_to_float(value):,.0f}"
+
+def template_report(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities):
+    """
+    Render the research report from the analysis results, with the same six
+    sections the LLM prompt asks for. Deterministic and fast, so it can
+    stand in when the LLM is too slow or unavailable.
+    """
+    company = customer_profile['company_name']
+    products = [str(product) for product in customer_profile['products_purchased']]
+    frequency = pattern_analysis.get('customer_product_frequency', {})
+    frequent = pattern_analysis.get('frequent_products_industry', [])
+    missing = [product for product in pattern_analysis.get('missing_opportunities', []) if product in frequent]
+    related = list(affinity_analysis.get('top_recommendations', {}).items())[:5]
+    top = sorted(scored_opportunities, key=lambda opportunity: opportunity['score'], reverse=True)[:5]
+
+    lines = [
+        f"# Research Report: {company}",
+        "",
+        "## Introduction",
+        f"This report reviews the purchase history of {company}, a {customer_profile['priority_rating']} "
+        f"priority {customer_profile['industry']} account, and sets out the sales opportunities it supports.",
+        "",
+        "## Customer Overview",
+        f"- Industry: {customer_profile['industry']}",
+        f"- Annual revenue: {_money(customer_profile['annual_revenue'])}",
+        f"- Employees: {customer_profile['employees']}",
+        f"- Priority rating: {customer_profile['priority_rating']}",
+        f"- Total spent: {_money(customer_profile['total_spent'])} over "
+        f"{customer_profile['purchase_frequency']} purchases",
+        f"- Current products: {customer_profile['current_products']}",
+        f"- Products purchased: {', '.join(products) if products else 'none'}",
+        "",
+        "## Data Analysis",
+    ]
+    if frequency:
+        most_bought = sorted(frequency.items(), key=lambda item: item[1], reverse=True)[:3]
+        lines.append("- Most purchased: " + ", ".join(f"{product} ({count}x)" for product, count in most_bought))
+    total_industry = pattern_analysis.get('total_industry_customers', 0)
+    if missing:
+        lines.append(f"- Bought by other {customer_profile['industry']} customers but not yet by {company}: "
+                     f"{', '.join(str(product) for product in missing)}")
+    elif total_industry:
+        lines.append(f"- Already buys what is common among {total_industry} {customer_profile['industry']} customers")
+    else:
+        lines.append(f"- No other {customer_profile['industry']} customers to compare against")
+    if pattern_analysis.get('lookalike_opportunities'):
+        lines.append(f"- Bought by the {len(pattern_analysis['lookalike_customers'])} most similar customers but not yet "
+                     f"by {company}: {', '.join(str(product) for product in pattern_analysis['lookalike_opportunities'])}")
+    if related:
+        lines.append(f"- Bought by {affinity_analysis.get('related_customer_count', 0)} customers with overlapping "
+                     "purchases: " + ", ".join(f"{product} ({count})" for product, count in related))
+    lines.append(f"- {len(scored_opportunities)} opportunities identified")
+    lines += ["", "## Recommendations"]
+    if top:
+        for number, opportunity in enumerate(top, 1):
+            lines.append(f"{number}. **{opportunity['product']}** ({opportunity['type']}, score "
+                         f"{opportunity['score']:.2f}): {opportunity['reason']}")
+    else:
+        lines.append("No opportunities stand out in the current data; maintain the account relationship.")
+    if not top:
+        conclusion = f"{company} has no pressing opportunities in the current data."
+    elif len(top) == 1:
+        conclusion = f"Approach {company} about {top[0]['product']}."
+    else:
+        conclusion = (f"Approach {company} about {top[0]['product']} first, "
+                      f"then the other {len(top) - 1} recommendations above.")
+    lines += ["", "## Conclusion", conclusion]
+    return "\n".join(lines)
+
+def _report_failed(report):
+    return report is None or report.startswith(REPORT_FAILURE_PREFIX)
+
+# Reports the caller stopped waiting for keep running, so their result
+# still reaches the report cache for the next request
+_background_reports = set()
+_report_executor = None
+
+def _get_report_executor():
+    global _report_executor
+    with _client_lock:
+        if _report_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _report_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="report")
+        return _report_executor
+
+def _report_mode(mode):
+    mode = mode or REPORT_MODE
+    if mode not in REPORT_MODES:
+        raise ValueError(f"Unknown report mode {mode!r}; expected one of {', '.join(REPORT_MODES)}")
+    return mode
+
+def generate_report(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                    mode=None, interactive=True):
+    """
+    Produce the research report in `mode` (default REPORT_MODE). Returns
+    the report and where it came from, "template" or "llm".
+    """
+    mode = _report_mode(mode)
+    args = (customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    if mode == "template":
+        return template_report(*args), "template"
+    if mode == "llm":
+        return recommendation_report_agent(*args, interactive=interactive), "llm"
+    future = _get_report_executor().submit(recommendation_report_agent, *args, interactive=interactive)
+    try:
+        report = future.result(timeout=LLM_REPORT_BUDGET_SECONDS)
+    except Exception:
+        report = None
+    if _report_failed(report):
+        return template_report(*args), "template"
+    return report, "llm"
+
+async def generate_report_async(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                                mode=None, interactive=True):
+    """Async variant of generate_report"""
+    mode = _report_mode(mode)
+    args = (customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    if mode == "template":
+        return template_report(*args), "template"
+    if mode == "llm":
+        return await recommendation_report_agent_async(*args, interactive=interactive), "llm"
+    task = asyncio.ensure_future(recommendation_report_agent_async(*args, interactive=interactive))
+    _background_reports.add(task)
+    task.add_done_callback(_background_reports.discard)
+    try:
+        report = await asyncio.wait_for(asyncio.shield(task), LLM_REPORT_BUDGET_SECONDS)
+    except asyncio.TimeoutError:
+        report = None
+    if _report_failed(report):
+        return template_report(*args), "template"
+    return report, "llm"
+
+async def _finish_stream(first, stream):
+    """Read an abandoned report stream to the end so it still reaches the report cache"""
+    try:
+        await first
+        async for _ in stream:
+            pass
+    except Exception:
+        pass
+
+async def stream_report_async(customer_profile, pattern_analysis, affinity_analysis, scored_opportunities,
+                              mode=None, interactive=True):
+    """
+    Stream the research report in `mode` as (text, source) chunks. In auto
+    mode the template is sent instead when the model fails or has sent no
+    text within LLM_REPORT_BUDGET_SECONDS, as generate_report does.
+    """
+    mode = _report_mode(mode)
+    args = (customer_profile, pattern_analysis, affinity_analysis, scored_opportunities)
+    if mode == "template":
+        yield template_report(*args), "template"
+        return
+    stream = stream_recommendation_report_async(*args, interactive=interactive)
+    if mode == "llm":
+        async for text in stream:
+            yield text, "llm"
+        return
+    first = asyncio.ensure_future(stream.__anext__())
+    try:
+        text = await asyncio.wait_for(asyncio.shield(first), LLM_REPORT_BUDGET_SECONDS)
+    except asyncio.TimeoutError:
+        task = asyncio.ensure_future(_finish_stream(first, stream))
+        _background_reports.add(task)
+        task.add_done_callback(_background_reports.discard)
+        text = None
+    except StopAsyncIteration:
+        text = None
+    if text is None or _report_failed(text):
+        yield template_report(*args), "template"
+        return
+    yield text, "llm"
+    async for text in stream:
+        yield text, "llm"
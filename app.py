@@ -1,7 +1,71 @@
 import streamlit as st
 import pandas as pd
 from pipeline import build_pipeline
+from agents import stream_recommendation_report
+from data_loader import load_customer_data_stream, stream_digest, get_customer_index
+from collections import OrderedDict
 import json
+import os
+import threading
+
+# Uploaded datasets kept parsed, with their pipelines, across reruns and sessions
+UPLOAD_CACHE_ENTRIES = int(os.getenv('UPLOAD_CACHE_ENTRIES', '4'))
+
+class Dataset:
+    """An uploaded file parsed and indexed, with the pipeline compiled over it"""
+
+    def __init__(self, data):
+        self.data = data
+        self.index = get_customer_index(data)
+        self.pipeline = build_pipeline(data, include_report=False)
+
+class DatasetCache:
+    """Datasets by upload content hash; the least recently used is evicted first"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is not None:
+                self._datasets.move_to_end(key)
+            return dataset
+
+    def put(self, key, dataset):
+        with self._lock:
+            self._datasets[key] = dataset
+            self._datasets.move_to_end(key)
+            while len(self._datasets) > self.max_entries:
+                self._datasets.popitem(last=False)
+
+@st.cache_resource
+def get_dataset_cache():
+    return DatasetCache(UPLOAD_CACHE_ENTRIES)
+
+def load_dataset(uploaded_file):
+    """
+    The dataset for an upload. The same contents are parsed and compiled
+    once; a new upload is read in chunks with a progress bar.
+    """
+    uploaded_file.seek(0)
+    key = stream_digest(uploaded_file)
+    cache = get_dataset_cache()
+    dataset = cache.get(key)
+    if dataset is None:
+        progress = st.progress(0.0, text="Reading upload...")
+        def show_progress(bytes_read, total_bytes):
+            progress.progress(min(bytes_read / max(total_bytes, 1), 1.0),
+                              text=f"Reading upload... {bytes_read / 2**20:.1f} of {total_bytes / 2**20:.1f} MB")
+        uploaded_file.seek(0)
+        data = load_customer_data_stream(uploaded_file, uploaded_file.size, on_progress=show_progress)
+        progress.progress(1.0, text="Building analysis pipeline...")
+        dataset = Dataset(data)
+        cache.put(key, dataset)
+        progress.empty()
+    return dataset
 
 st.set_page_config(
     page_title="B2B Sales Analyst AI",
@@ -16,13 +80,14 @@ st.markdown("Analyze customer data for cross-sell and upsell opportunities")
 uploaded_file = st.file_uploader(
     "Upload your customer data CSV file",
     type=['csv'],
-    help="Upload a CSV file with columns: customer_id, product_name, purchase_date, amount, category"
+    help="Upload a CSV file in the customer_data.csv format (Customer_ID, Customer_Name, Industry, Product, ...)"
 )
 
 if uploaded_file is not None:
     try:
-        # Load data
-        df = pd.read_csv(uploaded_file)
+        # Load data, parsed once per distinct upload
+        dataset = load_dataset(uploaded_file)
+        df = dataset.data
         st.success(f"✅ Data loaded successfully! Found {len(df)} records")
         
         # Show data preview
@@ -31,8 +96,8 @@ if uploaded_file is not None:
             st.write(f"**Columns:** {list(df.columns)}")
         
         # Customer selection
-        if 'customer_id' in df.columns:
-            customer_ids = df['customer_id'].unique()
+        if 'Customer_ID' in df.columns:
+            customer_ids = dataset.index.customer_ids
             selected_customer = st.selectbox(
                 "Select a customer to analyze:",
                 customer_ids,
@@ -42,8 +107,8 @@ if uploaded_file is not None:
             if st.button("🚀 Generate Analysis", type="primary"):
                 with st.spinner("Analyzing customer data..."):
                     try:
-                        # Build and run pipeline
-                        pipeline = build_pipeline(df)
+                        # Reuse the pipeline compiled for this upload
+                        pipeline = dataset.pipeline
                         
                         # Initialize state
                         initial_state = {
@@ -100,14 +165,25 @@ if uploaded_file is not None:
                                 for i, opp in enumerate(opportunities, 1):
                                     st.write(f"**{i}. {opp['product']}**")
                                     st.write(f"   Score: {opp['score']}/10")
-                                    st.write(f"   Reasoning: {opp['reasoning']}")
+                                    st.write(f"   Reasoning: {opp['reason']}")
                                     st.write("---")
                             else:
                                 st.write("No opportunities identified")
                         
                         # Research Report
                         with st.expander("📋 Research Report", expanded=True):
-                            st.markdown(result['research_report'])
+                            report_placeholder = st.empty()
+                            report = ""
+                            for chunk in stream_recommendation_report(
+                                result['customer_profile'],
+                                result['pattern_analysis'],
+                                result['affinity_analysis'],
+                                result['scored_opportunities']
+                            ):
+                                report += chunk
+                                report_placeholder.markdown(report + "▌")
+                            report_placeholder.markdown(report)
+                            result['research_report'] = report
                         
                         # Download results
                         results_data = {
@@ -130,11 +206,11 @@ if uploaded_file is not None:
                         st.error(f"❌ Error during analysis: {str(e)}")
                         st.exception(e)
         else:
-            st.error("❌ CSV file must contain a 'customer_id' column")
+            st.error("❌ CSV file must contain a 'Customer_ID' column")
             
     except Exception as e:
         st.error(f"❌ Error loading file: {str(e)}")
-        st.write("Please ensure your CSV file has the correct format with columns: customer_id, product_name, purchase_date, amount, category")
+        st.write("Please ensure your CSV file has the same format as customer_data.csv, with a Customer_ID column")
 
 else:
     st.info("📁 Please upload a CSV file to begin analysis")
@@ -142,10 +218,11 @@ else:
     # Sample data format
     st.markdown("### 📋 Expected CSV Format")
     sample_data = {
-        'customer_id': ['CUST001', 'CUST001', 'CUST002'],
-        'product_name': ['Product A', 'Product B', 'Product C'],
-        'purchase_date': ['2024-01-15', '2024-02-20', '2024-01-10'],
-        'amount': [1000.00, 2500.00, 1500.00],
-        'category': ['Software', 'Hardware', 'Services']
+        'Customer_ID': ['C001', 'C001', 'C002'],
+        'Customer_Name': ['Edge Communications', 'Edge Communications', 'Burlington Textiles Corp'],
+        'Industry': ['Electronics', 'Electronics', 'Apparel'],
+        'Product': ['Drill Bits', 'Generators', 'Safety Gear'],
+        'Total_Price(USD)': [1000.00, 2500.00, 1500.00],
+        'Purchase_Date': ['2024-01-15', '2024-02-20', '2024-01-10']
     }
     st.dataframe(pd.DataFrame(sample_data)) 
\ No newline at end of file
@@ -13,38 +13,45 @@ st.markdown("""
 This app analyzes customer data and generates cross-sell/upsell recommendations and a research report.
 """)
 
-# Load data with error handling
-@st.cache_data
-def load_data():
-    try:
-        from data_loader import load_customer_data_csv
-        data = load_customer_data_csv('customer_data.csv')
-        return data
-    except Exception as e:
-        st.error(f"Error loading data: {e}")
-        return None
+class DataService:
+    """
+    The customer data and its indexes, loaded once and shared by every
+    session and rerun. Lookups read from the shared indexes instead of
+    caching a copy of each customer's or industry's rows, so memory does
+    not grow as users browse.
+    """
 
-# Load unique customer IDs only
-@st.cache_data
-def load_customer_ids():
-    try:
-        from data_loader import load_customer_data_csv
-        data = load_customer_data_csv('customer_data.csv')
-        return sorted(data['Customer_ID'].unique().tolist())
-    except Exception as e:
-        st.error(f"Error loading customer IDs: {e}")
-        return []
+    def __init__(self, file_path):
+        from data_loader import load_customer_data as load_data_file, get_customer_index
+        self.data = load_data_file(file_path)
+        self.index = get_customer_index(self.data)
+        # Also used by the pipeline; built here so the first analysis does not wait
+        self.index.aggregates
+
+    @property
+    def customer_ids(self):
+        return self.index.customer_ids
+
+    def customer_info(self, customer_id):
+        """Customer attributes, from the customer's first record"""
+        return self.index.customer_record(customer_id)
+
+    def customer_purchases(self, customer_id):
+        """The customer's purchases, read from its rows of the shared frame"""
+        return self.index.customer_purchases(customer_id)
 
-# Load specific customer data
-@st.cache_data
-def load_customer_data(customer_id):
+    def top_industry_products(self, industry, limit=5):
+        """Most purchased products in an industry, with their purchase counts"""
+        counts, _ = self.index.aggregates.industry_product_counts(industry)
+        return counts[counts > 0].head(limit)
+
+# Load data with error handling
+@st.cache_resource
+def load_data_service():
     try:
-        from data_loader import load_customer_data_csv
-        data = load_customer_data_csv('customer_data.csv')
-        customer_data = data[data['Customer_ID'] == customer_id]
-        return customer_data
+        return DataService('customer_data.csv')
     except Exception as e:
-        st.error(f"Error loading customer data: {e}")
+        st.error(f"Error loading data: {e}")
         return None
 
 # Load pipeline with error handling
@@ -52,16 +59,18 @@ def load_customer_data(customer_id):
 def load_pipeline():
     try:
         from pipeline import build_pipeline
-        customer_data = load_data()
-        if customer_data is not None:
-            pipeline = build_pipeline(customer_data)
+        service = load_data_service()
+        if service is not None:
+            # The report is streamed separately so it renders as it is written
+            pipeline = build_pipeline(service.data, include_report=False)
             return pipeline
     except Exception as e:
         st.error(f"LangGraph pipeline failed: {e}")
         return None
 
 # Load customer IDs and pipeline
-customer_ids = load_customer_ids()
+data_service = load_data_service()
+customer_ids = data_service.customer_ids if data_service is not None else []
 pipeline = load_pipeline()
 
 if not customer_ids:
@@ -83,9 +92,9 @@ selected_customer = st.sidebar.selectbox("Select Customer ID", customer_ids)
 customer_data = None
 customer_info = None
 if selected_customer:
-    customer_data = load_customer_data(selected_customer)
-    if customer_data is not None and not customer_data.empty:
-        customer_info = customer_data.iloc[0]
+    customer_data = data_service.customer_purchases(selected_customer)
+    if not customer_data.empty:
+        customer_info = data_service.customer_info(selected_customer)
 
 # Show customer info
 if customer_info is not None:
@@ -99,6 +108,27 @@ if st.sidebar.button("🚀 Run Analysis", type="primary"):
         with st.spinner("Running AI analysis..."):
             try:
                 result = pipeline.invoke({"customer_id": selected_customer})
+            except Exception as e:
+                result = None
+                st.error(f"❌ Error during analysis: {e}")
+                import traceback
+                st.code(traceback.format_exc())
+        
+        if result is not None:
+            try:
+                from agents import stream_recommendation_report
+                report_placeholder = st.empty()
+                report = ""
+                for chunk in stream_recommendation_report(
+                    result['customer_profile'],
+                    result['pattern_analysis'],
+                    result['affinity_analysis'],
+                    result['scored_opportunities']
+                ):
+                    report += chunk
+                    report_placeholder.markdown("**Writing research report...**\n\n" + report + "▌")
+                report_placeholder.empty()
+                result['research_report'] = report
                 
                 # Store results in session state
                 st.session_state.analysis_results = result
@@ -225,12 +255,12 @@ if st.session_state.analysis_results and customer_data is not None:
             with col1:
                 st.subheader("Purchase History")
                 # Convert dates
-                customer_data['Purchase_Date'] = pd.to_datetime(customer_data['Purchase_Date'])
-                customer_data = customer_data.sort_values('Purchase_Date')
+                purchases = customer_data.assign(Purchase_Date=pd.to_datetime(customer_data['Purchase_Date']))
+                purchases = purchases.sort_values('Purchase_Date')
                 
                 # Show recent purchases
                 st.write("**Recent Purchases:**")
-                for _, row in customer_data.head(5).iterrows():
+                for _, row in purchases.head(5).iterrows():
                     try:
                         price = float(row['Total_Price(USD)'])
                         st.write(f"• {row['Product']} - ${price:,} ({row['Purchase_Date'].strftime('%Y-%m-%d')})")
@@ -240,16 +270,8 @@ if st.session_state.analysis_results and customer_data is not None:
             with col2:
                 st.subheader("Industry Comparison")
                 if customer_info is not None:
-                    # Load industry data only when needed
-                    @st.cache_data
-                    def load_industry_data(industry):
-                        from data_loader import load_customer_data_csv
-                        data = load_customer_data_csv('customer_data.csv')
-                        return data[data['Industry'] == industry]
-                    
-                    industry_data = load_industry_data(customer_info['Industry'])
-                    if not industry_data.empty:
-                        top_products = industry_data['Product'].value_counts().head(5)
+                    top_products = data_service.top_industry_products(customer_info['Industry'])
+                    if not top_products.empty:
                         st.write("**Top Products in Industry:**")
                         for product, count in top_products.items():
                             st.write(f"• {product} ({count} purchases)")
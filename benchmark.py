@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator and per-stage benchmarks for the analysis pipeline.
+
+    python benchmark.py generate synthetic.csv --customers 100000 --rows 5000000
+    python benchmark.py run synthetic.csv --output results.json
+    python benchmark.py compare baseline.json results.json
+
+`generate` writes a CSV with the customer_data.csv schema. `run` times the
+loader, the index builds, each agent and a full pipeline invoke with the LLM
+replaced by a stub, and writes the timings as JSON. `compare` reports stages
+that got slower between two result files.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+
+# Timings should not depend on what an earlier run left in the caches
+os.environ['REPORT_CACHE_ENABLED'] = 'false'
+os.environ['DATA_SNAPSHOT_ENABLED'] = 'false'
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_FORMAT = 1
+
+COLUMNS = [
+    'Customer_ID', 'Product', 'Quantity', 'Unit Price(USD)', 'Total_Price(USD)', 'Purchase_Date',
+    'Customer_Name', 'Industry', 'Annual_Revenue(USD)', 'Number_of_Employees', 'Customer_Priority_Rating',
+    'Account_Type', 'Location', 'Current_Products', 'Product_Usage(%)', 'Cross-Sell_Synergy',
+    'Last_Activity_Date', 'Opportunity_Stage', 'Opportunity_Amount(USD)', 'Opportunity_Type', 'Competitors',
+    'Activity_Status', 'Activity_Priority', 'Activity_Type', 'Product_SKU'
+]
+
+INDUSTRIES = ['Electronics', 'Apparel', 'Hospitality', 'Energy', 'Construction', 'Healthcare', 'Retail',
+              'Manufacturing', 'Finance', 'Logistics', 'Education', 'Telecommunications']
+PRODUCTS = ['Drill Bits', 'Protective Gloves', 'Drills', 'Backup Batteries', 'Advanced Analytics', 'Generators',
+            'Safety Helmets', 'Power Tools', 'Workflow Automation', 'Cloud Storage', 'API Integrations',
+            'AI Insights Module', 'Collaboration Suite', 'Reporting Dashboard', 'Core Management Platform']
+LOCATIONS = ['Austin, TX, USA', 'Burlington, NC, USA', 'Chicago, IL, USA', 'New York, NY, USA', 'Paris, France',
+             'London, UK', 'Berlin, Germany', 'Toronto, Canada', 'Singapore', 'Sydney, Australia']
+ACCOUNT_TYPES = ['Hot Customer - Direct', 'Warm Customer - Direct', 'Warm Customer - Channel', 'Cold Customer - Channel']
+PRIORITIES = ['High', 'Medium', 'Low']
+STAGES = ['Prospecting', 'Qualification', 'Negotiation/Review', 'Closed Won', 'Closed Lost']
+OPPORTUNITY_TYPES = ['New Customer', 'Existing Customer - Upgrade', 'Existing Customer - Replacement']
+COMPETITORS = ['John Deere', 'Mitsubishi', 'Fujitsu', 'Caterpillar', 'Hawkpower', 'Siemens', 'Bosch']
+UNIT_PRICES = [100, 250, 500, 750, 1000]
+
+def _names(base, count, prefix):
+    """`count` labels: the base names first, then numbered ones"""
+    return (base + [f"{prefix} {i}" for i in range(len(base) + 1, count + 1)])[:count]
+
+# --- Synthetic data ---
+def generate_customer_data(path, customers=1000, products=15, industries=5, rows=50000,
+                           seed=42, chunk_rows=1000000):
+    """
+    Write `rows` purchase records for `customers` accounts to `path` in the
+    customer_data.csv schema. Each industry prefers its own products and a
+    few accounts place most of the orders, so the pattern and affinity
+    indexes see realistic skew. Rows are written in chunks, so memory use
+    does not grow with `rows`. The same arguments always produce the same file.
+    """
+    rng = np.random.default_rng(seed)
+    industry_names = np.array(_names(INDUSTRIES, industries, 'Industry'), dtype=object)
+    product_names = np.array(_names(PRODUCTS, products, 'Product'), dtype=object)
+    skus = np.array([f"SK{i:05d}" for i in range(products)], dtype=object)
+    width = max(3, len(str(customers)))
+    industry_of = rng.integers(0, industries, customers)
+
+    # Customer attributes, one draw per account
+    customer = pd.DataFrame({
+        'Customer_ID': [f"C{i:0{width}d}" for i in range(1, customers + 1)],
+        'Customer_Name': [f"Company {i}" for i in range(1, customers + 1)],
+        'Industry': industry_names[industry_of],
+        'Annual_Revenue(USD)': (rng.lognormal(19, 1.5, customers) // 1000 * 1000).astype(np.int64),
+        'Number_of_Employees': rng.integers(10, 200000, customers),
+        'Customer_Priority_Rating': rng.choice(PRIORITIES, customers, p=[0.3, 0.5, 0.2]),
+        'Account_Type': rng.choice(ACCOUNT_TYPES, customers),
+        'Location': rng.choice(LOCATIONS, customers),
+        'Current_Products': rng.choice(product_names, customers),
+        'Product_Usage(%)': rng.integers(10, 101, customers),
+        'Cross-Sell_Synergy': [f"{p}, {chr(65 + i % 26)}" for i, p in enumerate(rng.choice(product_names, customers))],
+        'Last_Activity_Date': (np.datetime64('2024-01-01') + rng.integers(0, 366, customers)).astype(str),
+        'Opportunity_Stage': rng.choice(STAGES, customers),
+        'Opportunity_Amount(USD)': rng.integers(1, 500, customers) * 1000,
+        'Opportunity_Type': rng.choice(OPPORTUNITY_TYPES, customers),
+        'Competitors': [", ".join(c) for c in rng.choice(COMPETITORS, (customers, 2))],
+        'Activity_Status': rng.choice(['Completed', 'Open'], customers),
+        'Activity_Priority': rng.choice(['High', 'Medium', 'Low'], customers),
+        'Activity_Type': rng.choice(['Call', 'Email', 'Meeting'], customers),
+    })
+    # Each industry ranks the products in its own order
+    preferences = np.array([rng.permutation(products) for _ in range(industries)])
+    product_weights = 1.0 / np.arange(1, products + 1)
+    product_weights /= product_weights.sum()
+    customer_weights = rng.pareto(1.5, customers) + 1
+    customer_weights /= customer_weights.sum()
+
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        while written < rows:
+            n = min(chunk_rows, rows - written)
+            accounts = rng.choice(customers, n, p=customer_weights)
+            product = preferences[industry_of[accounts], rng.choice(products, n, p=product_weights)]
+            quantity = rng.integers(1, 11, n)
+            unit_price = rng.choice(UNIT_PRICES, n)
+            chunk = customer.take(accounts).reset_index(drop=True)
+            chunk.insert(1, 'Product', product_names[product])
+            chunk.insert(2, 'Quantity', quantity)
+            chunk.insert(3, 'Unit Price(USD)', unit_price)
+            chunk.insert(4, 'Total_Price(USD)', quantity * unit_price)
+            chunk.insert(5, 'Purchase_Date', (np.datetime64('2024-01-01') + rng.integers(0, 366, n)).astype(str))
+            chunk['Product_SKU'] = skus[product]
+            chunk[COLUMNS].to_csv(f, header=written == 0, index=False)
+            written += n
+    return {
+        'path': path,
+        'customers': customers,
+        'products': products,
+        'industries': industries,
+        'rows': rows,
+        'seed': seed,
+        'file_bytes': os.path.getsize(path),
+    }
+
+# --- Benchmarks ---
+class StubCompletions:
+    """Stands in for the Groq completions API: a fixed report after `latency` seconds"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def create(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        message = types.SimpleNamespace(content="Benchmark report")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+def stub_llm(latency=0.0):
+    """Route report generation to StubCompletions instead of the Groq API"""
+    import agents
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=StubCompletions(latency)))
+    agents.get_groq_client = lambda: client
+
+def _stats(durations):
+    durations = np.asarray(durations, dtype=float)
+    return {
+        'calls': int(len(durations)),
+        'total_seconds': float(durations.sum()),
+        'mean_ms': float(durations.mean() * 1000),
+        'p50_ms': float(np.percentile(durations, 50) * 1000),
+        'p95_ms': float(np.percentile(durations, 95) * 1000),
+        'max_ms': float(durations.max() * 1000),
+    }
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(csv_path, samples=200, repeat=1, seed=0, llm_latency=0.0):
+    """
+    Time each stage over `csv_path` and return the results as a dict.
+    Per-customer stages run over the same `samples` customers, drawn with
+    `seed`; whole-table stages run `repeat` times.
+    """
+    import agents
+    from data_loader import (load_customer_data_csv, get_customer_index, CustomerIndex, write_snapshot,
+                             read_snapshot, feather)
+    from pipeline import build_pipeline
+
+    stub_llm(llm_latency)
+    stages = {}
+
+    def record(name, durations):
+        stages[name] = _stats(durations)
+        print(f"⏱️ {name}: {stages[name]['mean_ms']:.2f} ms mean over {stages[name]['calls']} calls")
+
+    # Loading and index builds, on a fresh frame each repeat
+    load_times, index_times, model_times, cooccurrence_times, aggregates_times = [], [], [], [], []
+    similarity_times = []
+    for _ in range(repeat):
+        customer_data, elapsed = _timed(load_customer_data_csv, csv_path)
+        load_times.append(elapsed)
+        # The loader already indexed the frame; time a separate build
+        index_times.append(_timed(CustomerIndex, customer_data)[1])
+        index = get_customer_index(customer_data)
+        model_times.append(_timed(index.customer_attributes)[1])
+        cooccurrence_times.append(_timed(lambda: index.cooccurrence)[1])
+        aggregates_times.append(_timed(lambda: index.aggregates)[1])
+        similarity_times.append(_timed(lambda: index.similarity)[1])
+    record('load_customer_data_csv', load_times)
+    record('customer_index', index_times)
+    record('customer_attributes', model_times)
+    record('cooccurrence_index', cooccurrence_times)
+    record('aggregates_index', aggregates_times)
+    record('similarity_index', similarity_times)
+
+    if feather is not None:
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_dir = os.path.join(directory, 'snapshot')
+            record('write_snapshot', [_timed(write_snapshot, customer_data, snapshot_dir)[1]])
+            record('read_snapshot', [_timed(read_snapshot, snapshot_dir)[1] for _ in range(repeat)])
+
+    rng = np.random.default_rng(seed)
+    customer_ids = list(rng.choice(index.customer_ids, min(samples, len(index)), replace=False))
+
+    # Each agent on its own, fed the previous agent's output
+    timings = {name: [] for name in ('customer_context_agent', 'purchase_pattern_agent', 'product_affinity_agent',
+                                     'opportunity_scoring_agent', 'recommendation_report_agent')}
+    for customer_id in customer_ids:
+        profile, elapsed = _timed(agents.customer_context_agent, customer_id, customer_data)
+        timings['customer_context_agent'].append(elapsed)
+        pattern, elapsed = _timed(agents.purchase_pattern_agent, profile, customer_data)
+        timings['purchase_pattern_agent'].append(elapsed)
+        affinity, elapsed = _timed(agents.product_affinity_agent, profile, customer_data)
+        timings['product_affinity_agent'].append(elapsed)
+        scored, elapsed = _timed(agents.opportunity_scoring_agent, profile, pattern, affinity)
+        timings['opportunity_scoring_agent'].append(elapsed)
+        _, elapsed = _timed(agents.recommendation_report_agent, profile, pattern, affinity, scored)
+        timings['recommendation_report_agent'].append(elapsed)
+    for name, durations in timings.items():
+        record(name, durations)
+
+    record('score_all_customers', [_timed(agents.score_all_customers, customer_data, customer_ids)[1]
+                                   for _ in range(repeat)])
+    record('score_all_customers_table', [_timed(agents.score_all_customers, customer_data)[1]
+                                         for _ in range(repeat)])
+    record('purchase_pattern_agent_lookalikes', [
+        _timed(agents.purchase_pattern_agent, agents.customer_context_agent(customer_id, customer_data),
+               customer_data, 10)[1]
+        for customer_id in customer_ids
+    ])
+
+    # The whole graph, as the API runs it
+    pipeline, elapsed = _timed(build_pipeline, customer_data)
+    record('build_pipeline', [elapsed])
+    record('pipeline_invoke', [_timed(pipeline.invoke, {"customer_id": customer_id})[1]
+                               for customer_id in customer_ids])
+
+    return {
+        'benchmark_format': BENCHMARK_FORMAT,
+        'timestamp': datetime.now().isoformat(),
+        'git_commit': _git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'dataset': {
+            'path': csv_path,
+            'file_bytes': os.path.getsize(csv_path),
+            'rows': len(customer_data),
+            'customers': len(index),
+            'memory_bytes': int(customer_data.memory_usage(deep=True).sum()),
+        },
+        'settings': {'samples': len(customer_ids), 'repeat': repeat, 'seed': seed, 'llm_latency': llm_latency},
+        'stages': stages,
+    }
+
+def compare_results(baseline, current, threshold=0.2, metric='mean_ms'):
+    """
+    Stages whose `metric` grew by more than `threshold` (a fraction) from
+    `baseline` to `current`, as (stage, baseline, current, change) tuples
+    """
+    regressions = []
+    for stage, result in current['stages'].items():
+        before = baseline['stages'].get(stage)
+        if not before or not before[metric]:
+            continue
+        change = result[metric] / before[metric] - 1
+        print(f"{'❌' if change > threshold else '✅'} {stage}: {before[metric]:.2f} -> {result[metric]:.2f} ms ({change:+.0%})")
+        if change > threshold:
+            regressions.append((stage, before[metric], result[metric], change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='Write a synthetic customer data CSV')
+    generate.add_argument('path')
+    generate.add_argument('--customers', type=int, default=1000)
+    generate.add_argument('--products', type=int, default=15)
+    generate.add_argument('--industries', type=int, default=5)
+    generate.add_argument('--rows', type=int, default=50000)
+    generate.add_argument('--seed', type=int, default=42)
+
+    run = commands.add_parser('run', help='Benchmark each stage over a CSV')
+    run.add_argument('path', help='CSV to benchmark; generated first with --generate')
+    run.add_argument('--generate', action='store_true', help='Generate the CSV with the sizes below first')
+    run.add_argument('--customers', type=int, default=1000)
+    run.add_argument('--products', type=int, default=15)
+    run.add_argument('--industries', type=int, default=5)
+    run.add_argument('--rows', type=int, default=50000)
+    run.add_argument('--samples', type=int, default=200, help='Customers timed in per-customer stages')
+    run.add_argument('--repeat', type=int, default=1, help='Runs of each whole-table stage')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--llm-latency', type=float, default=0.0, help='Seconds the stubbed LLM waits per report')
+    run.add_argument('--output', help='Write the results JSON here (default: stdout)')
+
+    compare = commands.add_parser('compare', help='Report stages that got slower between two runs')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown, as a fraction')
+    compare.add_argument('--metric', default='mean_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'max_ms'])
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate' or (args.command == 'run' and args.generate):
+        print(f"🏭 Generating {args.rows} rows for {args.customers} customers into {args.path}")
+        dataset, elapsed = _timed(generate_customer_data, args.path, customers=args.customers, products=args.products,
+                                  industries=args.industries, rows=args.rows, seed=getattr(args, 'seed', 42))
+        print(f"✅ Wrote {dataset['file_bytes']} bytes in {elapsed:.1f}s")
+        if args.command == 'generate':
+            return 0
+
+    if args.command == 'run':
+        results = run_benchmarks(args.path, samples=args.samples, repeat=args.repeat, seed=args.seed,
+                                 llm_latency=args.llm_latency)
+        output = json.dumps(results, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output)
+            print(f"📄 Results written to {args.output}")
+        else:
+            print(output)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, threshold=args.threshold, metric=args.metric)
+    print(f"{len(regressions)} stage(s) slower than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
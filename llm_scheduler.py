@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Queue priorities, lowest first: interactive requests go ahead of batch
+# work, and high-priority accounts ahead of the rest within each
+PRIORITY_INTERACTIVE_HIGH = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_BATCH_HIGH = 2
+PRIORITY_BATCH = 3
+
+# HTTP statuses worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+def report_priority(customer_profile: Optional[dict], interactive: bool = True) -> int:
+    """Queue priority of a report for a customer"""
+    high = bool(customer_profile) and customer_profile.get('priority_rating') == 'High'
+    if interactive:
+        return PRIORITY_INTERACTIVE_HIGH if high else PRIORITY_INTERACTIVE
+    return PRIORITY_BATCH_HIGH if high else PRIORITY_BATCH
+
+class _Waiter:
+    def __init__(self, tokens: float, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.tokens = tokens
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        if loop is not None:
+            self.future = loop.create_future()
+        else:
+            self.event = threading.Event()
+
+    def grant(self):
+        self.granted = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+        else:
+            self.event.set()
+
+class Reservation:
+    """A granted LLM call slot. Set used_tokens once the API reports usage."""
+
+    def __init__(self, estimated_tokens: float):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens: Optional[float] = None
+
+class LLMScheduler:
+    """
+    Admission control for LLM calls shared by every caller in the process.
+
+    Calls wait in a priority queue and are let through when a concurrency
+    slot is free and two token buckets allow it: one for requests per minute
+    and one for tokens per minute. Token use is estimated up front and
+    corrected with the usage the API reports. Only the head of the queue is
+    considered, so lower priorities cannot overtake it. Rate-limited and
+    transient failures are retried with jittered exponential backoff, and a
+    rate limit response pauses all calls for its Retry-After.
+    Works for threads and asyncio tasks alike.
+    """
+
+    def __init__(self, max_concurrency: int = 16, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 3, backoff_base: float = 1.0, backoff_max: float = 30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._request_budget = float(requests_per_minute)
+        self._token_budget = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._counters = {"granted": 0, "retries": 0, "rate_limited": 0}
+
+    # --- Admission ---
+    def _refill(self, now: float):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_minute > 0:
+            self._request_budget = min(self.requests_per_minute,
+                                       self._request_budget + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute > 0:
+            self._token_budget = min(self.tokens_per_minute,
+                                     self._token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def _clamped(self, tokens: float) -> float:
+        # A call larger than the whole bucket would otherwise never be let through
+        return min(tokens, self.tokens_per_minute) if self.tokens_per_minute > 0 else tokens
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        """Seconds until both buckets can cover a call, 0 if they can now"""
+        wait = max(0.0, self._paused_until - now)
+        if self.requests_per_minute > 0 and self._request_budget < 1:
+            wait = max(wait, (1 - self._request_budget) * 60 / self.requests_per_minute)
+        tokens = self._clamped(tokens)
+        if self.tokens_per_minute > 0 and self._token_budget < tokens:
+            wait = max(wait, (tokens - self._token_budget) * 60 / self.tokens_per_minute)
+        return wait
+
+    def _dispatch_locked(self):
+        while self._queue and self._active < self.max_concurrency:
+            waiter = self._queue[0][2]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_time(waiter.tokens, now)
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self._dispatch_later)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            heapq.heappop(self._queue)
+            if self.requests_per_minute > 0:
+                self._request_budget -= 1
+            if self.tokens_per_minute > 0:
+                self._token_budget -= self._clamped(waiter.tokens)
+            self._active += 1
+            self._counters["granted"] += 1
+            waiter.grant()
+
+    def _dispatch_later(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch_locked()
+
+    def _enqueue(self, priority: int, waiter: _Waiter):
+        with self._lock:
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._dispatch_locked()
+
+    def _release(self, reservation: Reservation):
+        with self._lock:
+            self._active -= 1
+            if self.tokens_per_minute > 0 and reservation.used_tokens is not None:
+                # Settle the estimate against what the call actually used
+                self._token_budget -= (self._clamped(reservation.used_tokens)
+                                       - self._clamped(reservation.estimated_tokens))
+            self._dispatch_locked()
+
+    @contextmanager
+    def reserve(self, priority: int = PRIORITY_INTERACTIVE, estimated_tokens: float = 0):
+        """Block until a call is admitted; the slot is held for the block"""
+        waiter = _Waiter(estimated_tokens)
+        self._enqueue(priority, waiter)
+        waiter.event.wait()
+        reservation = Reservation(estimated_tokens)
+        try:
+            yield reservation
+        finally:
+            self._release(reservation)
+
+    @asynccontextmanager
+    async def reserve_async(self, priority: int = PRIORITY_INTERACTIVE, estimated_tokens: float = 0):
+        """Async variant of reserve"""
+        waiter = _Waiter(estimated_tokens, asyncio.get_running_loop())
+        self._enqueue(priority, waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self._release(Reservation(estimated_tokens))
+            raise
+        reservation = Reservation(estimated_tokens)
+        try:
+            yield reservation
+        finally:
+            self._release(reservation)
+
+    # --- Retries ---
+    def retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Seconds to wait before retrying after `error` on attempt `attempt`
+        (0-based), or None when the error is not retryable or retries ran out
+        """
+        if attempt >= self.max_retries or not _retryable(error):
+            return None
+        # Full jitter keeps retrying callers from hitting the API in step
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        with self._lock:
+            self._counters["retries"] += 1
+            if _status(error) == 429:
+                self._counters["rate_limited"] += 1
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                # Everyone waits out a rate limit, not just this caller
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+    def call(self, make_call: Callable, priority: int = PRIORITY_INTERACTIVE, estimated_tokens: float = 0,
+             usage_tokens: Callable = lambda response: None):
+        """Run `make_call()` once admitted, retrying retryable failures"""
+        for attempt in itertools.count():
+            try:
+                with self.reserve(priority, estimated_tokens) as reservation:
+                    response = make_call()
+                    reservation.used_tokens = usage_tokens(response)
+                    return response
+            except Exception as e:
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def call_async(self, make_call: Callable, priority: int = PRIORITY_INTERACTIVE, estimated_tokens: float = 0,
+                         usage_tokens: Callable = lambda response: None):
+        """Async variant of call; `make_call()` returns an awaitable"""
+        for attempt in itertools.count():
+            try:
+                async with self.reserve_async(priority, estimated_tokens) as reservation:
+                    response = await make_call()
+                    reservation.used_tokens = usage_tokens(response)
+                    return response
+            except Exception as e:
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["queued"] = sum(1 for _, _, waiter in self._queue if not waiter.cancelled)
+            stats["active"] = self._active
+            return stats
+
+def _status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None)
+
+def _retryable(error: Exception) -> bool:
+    if _status(error) in RETRYABLE_STATUSES:
+        return True
+    # Connection failures and timeouts carry no status
+    import groq
+    return isinstance(error, (groq.APIConnectionError, groq.APITimeoutError))
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+# Number of processes splitting the configured budgets, see share_llm_budget
+_budget_share = 1
+
+def share_llm_budget(processes: int):
+    """
+    Give this process's scheduler 1/processes of the configured concurrency
+    and per-minute budgets, for one of several worker processes that call
+    the same API, so that together they stay within the limits.
+    """
+    global _scheduler, _budget_share
+    with _scheduler_lock:
+        _budget_share = max(1, processes)
+        _scheduler = None
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Process-wide scheduler configured from the environment"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')) // _budget_share,
+                requests_per_minute=float(os.getenv('LLM_REQUESTS_PER_MINUTE', '0')) / _budget_share,
+                tokens_per_minute=float(os.getenv('LLM_TOKENS_PER_MINUTE', '0')) / _budget_share,
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', '3')),
+                backoff_base=float(os.getenv('LLM_BACKOFF_BASE_SECONDS', '1')),
+                backoff_max=float(os.getenv('LLM_BACKOFF_MAX_SECONDS', '30')),
+            )
+        return _scheduler
@@ -1,10 +1,25 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from data_loader import load_customer_data_csv
-from typing import Optional, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from data_loader import CustomerDataFeed, CustomerSummary, get_customer_index, file_fingerprint
+from report_cache import get_report_cache
+from llm_scheduler import get_llm_scheduler
+from agents import generate_report_async, REPORT_MODE, REPORT_FAILURE_PREFIX
+from metrics import metrics_enabled, metrics_middleware, render_metrics
+from profiling import profile_run, ProfilerBusy
+from materialize import RecommendationStore
+from typing import Optional, Dict, Any, List
 import os
+import json
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
 import traceback
+import weakref
 from datetime import datetime
 
 app = FastAPI(
@@ -22,45 +37,279 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency and in-flight counts for /metrics
+app.middleware("http")(metrics_middleware)
+
 # Global variables
-customer_data = None
-pipeline = None
+current_snapshot = None
+data_feed = None
+
+# Seconds between checks for rows appended to CSV_PATH (0 disables the watcher)
+CSV_WATCH_INTERVAL_SECONDS = float(os.getenv('CSV_WATCH_INTERVAL_SECONDS', '0'))
+
+# Batch limits
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '500'))
+BATCH_REPORT_CONCURRENCY = int(os.getenv('BATCH_REPORT_CONCURRENCY', '4'))
+# Results precomputed by materialize.py, served while the data is unchanged
+PRECOMPUTED_RESULTS_PATH = os.getenv('PRECOMPUTED_RESULTS_PATH', '')
+PRECOMPUTED_MAX_AGE_SECONDS = float(os.getenv('PRECOMPUTED_MAX_AGE_SECONDS', '86400'))
+recommendation_store = RecommendationStore(PRECOMPUTED_RESULTS_PATH) if PRECOMPUTED_RESULTS_PATH else None
+
+# Key required in the X-Admin-Key header for admin-only options (unset disables them)
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')
+
+CUSTOMERS_PAGE_SIZE = int(os.getenv('CUSTOMERS_PAGE_SIZE', '100'))
+MAX_CUSTOMERS_PAGE_SIZE = int(os.getenv('MAX_CUSTOMERS_PAGE_SIZE', '1000'))
+
+# Largest neighbor count /similar and the lookalikes option accept
+MAX_SIMILAR_CUSTOMERS = int(os.getenv('MAX_SIMILAR_CUSTOMERS', '100'))
+
+# How long clients and proxies may reuse a response without revalidating
+# (0: revalidate with If-None-Match every time)
+HTTP_CACHE_MAX_AGE_SECONDS = int(os.getenv('HTTP_CACHE_MAX_AGE_SECONDS', '0'))
+
+# Accepted values of the report_mode option, see agents.REPORT_MODES
+REPORT_MODE_PATTERN = "^(template|llm|auto)$"
+
+class BatchRecommendationRequest(BaseModel):
+    customer_ids: List[str] = Field(..., description="Customer IDs to analyze (e.g., [\"C001\", \"C002\"])")
+    include_profile: bool = Field(False, description="Include customer profile in each result")
+    include_report: bool = Field(True, description="Generate a research report for each customer")
+    report_mode: Optional[str] = Field(None, pattern=REPORT_MODE_PATTERN,
+                                       description="template, llm or auto (default REPORT_MODE)")
+
+def summarize_opportunities(opportunities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summary block shared by the single and batch recommendation endpoints"""
+    return {
+        "total_recommendations": len(opportunities),
+        "cross_sell_count": len([r for r in opportunities if r.get('type') == 'Cross-sell']),
+        "upsell_count": len([r for r in opportunities if r.get('type') == 'Upsell']),
+        "top_recommendation_score": max([r.get('score', 0) for r in opportunities]) if opportunities else 0
+    }
+
+class DataSnapshot:
+    """
+    One version of the served data and its indexes, run through the shared
+    pipelines. Snapshots are never modified after they are published: each request
+    pins the current snapshot when it starts and uses it to the end, and a
+    reload publishes a new snapshot instead of changing this one.
+    """
+    
+    def __init__(self, customer_data, source: str):
+        self.version = 0
+        self.source = source
+        self.customer_data = customer_data
+        self.index = get_customer_index(customer_data)
+        # Every request reads these; ingest extends them rather than
+        # rebuilding. The customer summary and similarity index are built
+        # on first use.
+        self.index.cooccurrence
+        self.index.aggregates
+        self.created_at = datetime.now().isoformat()
+    
+    def invoke(self, state: Dict[str, Any], include_report: bool = True) -> Dict[str, Any]:
+        """Run the shared pipeline against this snapshot's data"""
+        from pipeline import get_shared_pipeline, pipeline_data
+        with pipeline_data(self.customer_data):
+            return get_shared_pipeline(include_report).invoke(state)
+    
+    async def ainvoke(self, state: Dict[str, Any], include_report: bool = True) -> Dict[str, Any]:
+        """Async variant of invoke"""
+        from pipeline import get_shared_pipeline, pipeline_data
+        with pipeline_data(self.customer_data):
+            return await get_shared_pipeline(include_report).ainvoke(state)
+    
+    def validate(self):
+        """Raise if this snapshot cannot serve requests"""
+        if self.customer_data is None or self.customer_data.empty:
+            raise ValueError("No customer records loaded")
+        if not len(self.index):
+            raise ValueError("No customer IDs found")
+        sample_id = self.index.customer_ids[0]
+        result = self.invoke({"customer_id": sample_id}, include_report=False)
+        if not result.get('customer_profile'):
+            raise ValueError(f"Analysis of sample customer {sample_id} returned no profile")
+
+# Published snapshots that are still referenced, by the current version or by
+# requests that started before a swap
+live_snapshots = weakref.WeakSet()
+snapshot_lock = threading.Lock()
+
+def publish_snapshot(data):
+    """
+    Build and validate a snapshot of freshly loaded data, then make it the
+    one new requests use. Raises, leaving the current snapshot in place, if
+    the new data does not pass validation.
+    """
+    global current_snapshot
+    csv_path = os.getenv('CSV_PATH', 'customer_data.csv')
+    snapshot = DataSnapshot(data, file_fingerprint(csv_path))
+    snapshot.validate()
+    with snapshot_lock:
+        snapshot.version = current_snapshot.version + 1 if current_snapshot is not None else 1
+        current_snapshot = snapshot
+        live_snapshots.add(snapshot)
+    
+    # Reports cached for an older version of the data are dropped
+    report_cache = get_report_cache()
+    if report_cache is not None:
+        report_cache.set_snapshot(snapshot.source)
+    print(f"✅ Serving data snapshot v{snapshot.version} ({len(data)} records)")
+
+def get_snapshot() -> DataSnapshot:
+    """The snapshot a request uses from start to finish"""
+    snapshot = current_snapshot
+    if snapshot is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="LangGraph pipeline not initialized. Please check server logs."
+        )
+    return snapshot
 
 def initialize_pipeline():
-    """Initialize the LangGraph pipeline"""
-    global customer_data, pipeline
+    """
+    Load the data and publish it as a new snapshot. The previous snapshot
+    keeps serving while this runs and stays in place if it fails.
+    """
+    global data_feed
     
     try:
-        from pipeline import build_pipeline
-        customer_data = load_customer_data_csv(os.getenv('CSV_PATH', 'customer_data.csv'))
-        pipeline = build_pipeline(customer_data)
+        csv_path = os.getenv('CSV_PATH', 'customer_data.csv')
+        if data_feed is not None and data_feed.file_path == csv_path:
+            data_feed.reload(publish_snapshot)
+        else:
+            feed = CustomerDataFeed(csv_path, publish_snapshot)
+            if data_feed is not None:
+                data_feed.stop()
+            data_feed = feed
         print("✅ LangGraph pipeline built successfully")
         return True
     except Exception as e:
         print(f"❌ LangGraph pipeline failed: {e}")
-        customer_data = None
-        pipeline = None
+        if current_snapshot is not None:
+            print(f"↩️ Still serving data snapshot v{current_snapshot.version}")
         return False
 
 # Initialize on startup
 initialize_pipeline()
 
+@app.on_event("startup")
+def start_data_watcher():
+    """Ingest appended rows in the background when CSV_WATCH_INTERVAL_SECONDS is set"""
+    if data_feed is not None and CSV_WATCH_INTERVAL_SECONDS > 0:
+        data_feed.watch(CSV_WATCH_INTERVAL_SECONDS, publish_snapshot)
+        print(f"👀 Watching {data_feed.file_path} every {CSV_WATCH_INTERVAL_SECONDS:g}s")
+
+@app.on_event("shutdown")
+async def shutdown_llm_clients():
+    """Close the shared LLM clients and their connection pools"""
+    from agents import close_llm_clients
+    await close_llm_clients()
+
+@app.on_event("shutdown")
+def stop_data_watcher():
+    if data_feed is not None:
+        data_feed.stop()
+
+def require_admin(admin_key: Optional[str]):
+    """Reject the request unless it carries the configured admin key"""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin options are disabled (ADMIN_API_KEY is not set)")
+    if not admin_key or not hmac.compare_digest(admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Admin-Key header")
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the given values: bodies also carry a timestamp"""
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+def snapshot_etag(snapshot: DataSnapshot, *parts) -> str:
+    """ETag of a response that only changes when the data does"""
+    return make_etag(snapshot.version, snapshot.source, *parts)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    max_age = HTTP_CACHE_MAX_AGE_SECONDS
+    return {"ETag": etag, "Cache-Control": f"public, max-age={max_age}" if max_age > 0 else "no-cache"}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+def precomputed_result(snapshot: DataSnapshot, customer_id: str):
+    """
+    The precomputed result for a customer if it was computed from the
+    snapshot's data and is recent enough, else None. Also returns the
+    freshness details reported with the response.
+    """
+    if recommendation_store is None:
+        return None, {"source": "live", "precomputed": "disabled"}
+    entry = recommendation_store.get(customer_id)
+    if entry is None:
+        return None, {"source": "live", "precomputed": "missing"}
+    age = time.time() - entry["computed_at"]
+    computed_at = datetime.fromtimestamp(entry["computed_at"]).isoformat()
+    if entry["data_source"] != snapshot.source:
+        return None, {"source": "live", "precomputed": "stale", "precomputed_at": computed_at}
+    if PRECOMPUTED_MAX_AGE_SECONDS > 0 and age > PRECOMPUTED_MAX_AGE_SECONDS:
+        return None, {"source": "live", "precomputed": "expired", "precomputed_at": computed_at}
+    return entry["result"], {"source": "precomputed", "computed_at": computed_at, "age_seconds": age}
+
+def validate_customer_request(snapshot: DataSnapshot, customer_id: str) -> str:
+    """Check the customer exists in the snapshot; returns the normalized ID"""
+    # Validate customer_id
+    if not customer_id or not customer_id.strip():
+        raise HTTPException(
+            status_code=400, 
+            detail="Customer ID is required"
+        )
+    
+    # Normalize customer_id
+    customer_id = customer_id.strip().upper()
+    
+    # Check if customer exists
+    if customer_id not in snapshot.index:
+        # The index keeps the canonical IDs sorted, so no pass over the rows
+        available_customers = snapshot.index.customer_ids
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Customer {customer_id} not found. Available customers: {available_customers}"
+        )
+    
+    return customer_id
+
 @app.get("/")
 def read_root():
     """Root endpoint with API information"""
+    snapshot = current_snapshot
     return {
         "message": "B2B Sales Analyst AI API",
         "version": "1.0.0",
         "status": "running",
         "pipeline_type": "LangGraph",
-        "available_customers": len(customer_data['Customer_ID'].unique()) if customer_data is not None else 0,
+        "available_customers": len(snapshot.index) if snapshot is not None else 0,
         "timestamp": datetime.now().isoformat()
     }
 
 @app.get("/recommendation")
-def get_recommendation(
+async def get_recommendation(
     customer_id: str = Query(..., description="Customer ID to analyze (e.g., C001, C002)"),
-    include_profile: bool = Query(False, description="Include customer profile in response")
+    include_profile: bool = Query(False, description="Include customer profile in response"),
+    profile: bool = Query(False, description="Profile the pipeline run (admin only)"),
+    profile_dump: bool = Query(False, description="Also write the profile to a file (admin only, with profile=true)"),
+    report_mode: Optional[str] = Query(None, pattern=REPORT_MODE_PATTERN,
+                                       description="template, llm or auto (default REPORT_MODE)"),
+    lookalikes: int = Query(0, ge=0, le=MAX_SIMILAR_CUSTOMERS,
+                            description="Also find product gaps among this many lookalike customers"),
+    x_admin_key: Optional[str] = Header(None, description="Admin key, required for profile=true"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previous response, answered with 304 if unchanged")
 ):
     """
     Get AI-generated recommendations and research report for a customer using LangGraph pipeline.
@@ -68,43 +317,65 @@ def get_recommendation(
     Args:
         customer_id: The customer ID to analyze
         include_profile: Whether to include customer profile in response
+        profile: Whether to run under the profiler and include its report
+        profile_dump: Whether to write the profile to PROFILE_DIR
+        report_mode: How to produce the research report: rendered from
+            the analysis ("template"), by the LLM ("llm"), or by the LLM
+            with the template as fallback when it is slow ("auto")
+        lookalikes: Number of nearest lookalike customers whose purchases
+            are checked for gaps, in addition to the customer's industry
     
     Returns:
-        JSON with research report and recommendations
+        JSON with research report and recommendations, or 304 when
+        If-None-Match still matches for the loaded data
     """
-    # Validate pipeline
-    if not pipeline or customer_data is None or customer_data.empty:
-        raise HTTPException(
-            status_code=503, 
-            detail="LangGraph pipeline not initialized. Please check server logs."
-        )
-    
-    # Validate customer_id
-    if not customer_id or not customer_id.strip():
-        raise HTTPException(
-            status_code=400, 
-            detail="Customer ID is required"
-        )
-    
-    # Normalize customer_id
-    customer_id = customer_id.strip().upper()
-    
-    # Check if customer exists
-    customer_exists = customer_data[
-        customer_data['Customer_ID'].astype(str).str.strip().str.upper() == customer_id
-    ].shape[0] > 0
-    
-    if not customer_exists:
-        available_customers = sorted(customer_data['Customer_ID'].unique().tolist())
-        raise HTTPException(
-            status_code=404, 
-            detail=f"Customer {customer_id} not found. Available customers: {available_customers}"
-        )
+    if profile:
+        require_admin(x_admin_key)
+    snapshot = get_snapshot()
+    customer_id = validate_customer_request(snapshot, customer_id)
+    mode = report_mode or REPORT_MODE
+    # Profiled runs are measurements, never answered from a cache
+    etag = None if profile else snapshot_etag(snapshot, "recommendation", customer_id, include_profile, mode,
+                                              lookalikes)
+    if etag is not None and etag_matches(if_none_match, etag):
+        return not_modified(etag)
     
     try:
         # Run the LangGraph pipeline
         initial_state = {"customer_id": customer_id}
-        result = pipeline.invoke(initial_state)
+        if report_mode:
+            initial_state["report_mode"] = report_mode
+        if lookalikes:
+            initial_state["lookalikes"] = lookalikes
+        profile_report = None
+        if profile:
+            # Synchronous run in a worker thread, so every stage is a plain
+            # function call the profiler can attribute
+            result, profile_report = await run_in_threadpool(
+                profile_run, snapshot.invoke, initial_state,
+                dump_name=customer_id if profile_dump else None
+            )
+            freshness = {"source": "live", "precomputed": "bypassed"}
+        elif lookalikes:
+            # Precomputed results only cover the industry analysis
+            result = await snapshot.ainvoke(initial_state)
+            freshness = {"source": "live", "precomputed": "bypassed"}
+        else:
+            result, freshness = precomputed_result(snapshot, customer_id)
+            if result is None:
+                result = await snapshot.ainvoke(initial_state)
+            elif result.get('research_report') is None or mode == "template":
+                # Materialized without reports (or a template was asked
+                # for): only the report is produced live
+                result['research_report'], result['report_source'] = await generate_report_async(
+                    result['customer_profile'],
+                    result['pattern_analysis'],
+                    result['affinity_analysis'],
+                    result['scored_opportunities'],
+                    mode=report_mode
+                )
+            else:
+                result['report_source'] = "llm"
         
         # Validate result
         if not result or not result.get('customer_profile'):
@@ -119,20 +390,31 @@ def get_recommendation(
             "timestamp": datetime.now().isoformat(),
             "pipeline_type": "LangGraph",
             "research_report": result.get('research_report', ''),
+            "report_source": result.get('report_source'),
             "recommendations": result.get('scored_opportunities', []),
-            "summary": {
-                "total_recommendations": len(result.get('scored_opportunities', [])),
-                "cross_sell_count": len([r for r in result.get('scored_opportunities', []) if r.get('type') == 'Cross-sell']),
-                "upsell_count": len([r for r in result.get('scored_opportunities', []) if r.get('type') == 'Upsell']),
-                "top_recommendation_score": max([r.get('score', 0) for r in result.get('scored_opportunities', [])]) if result.get('scored_opportunities') else 0
-            }
+            "summary": summarize_opportunities(result.get('scored_opportunities', [])),
+            "freshness": freshness
         }
         
         # Include customer profile if requested
         if include_profile:
             response["customer_profile"] = result.get('customer_profile')
         
-        return JSONResponse(response)
+        if profile_report is not None:
+            response["profile"] = profile_report
+        
+        # A failed report, or a template standing in for a slow LLM, should
+        # be replaced on the next request rather than revalidated
+        report = response["research_report"] or ''
+        if etag is None or report.startswith(REPORT_FAILURE_PREFIX) or (
+                mode == "auto" and response["report_source"] == "template"):
+            headers = {"Cache-Control": "no-store"}
+        else:
+            headers = cache_headers(etag)
+        return JSONResponse(response, headers=headers)
+        
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
         
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -145,38 +427,307 @@ def get_recommendation(
             detail=f"Processing error: {str(e)}"
         )
 
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.get("/recommendation/stream")
+async def stream_recommendation(
+    customer_id: str = Query(..., description="Customer ID to analyze (e.g., C001, C002)"),
+    report_mode: Optional[str] = Query(None, pattern=REPORT_MODE_PATTERN,
+                                       description="template, llm or auto (default REPORT_MODE)")
+):
+    """
+    Stream a customer's analysis as server-sent events.
+    
+    The deterministic sections are sent as soon as they are computed, then the
+    research report is streamed as the model produces it. A template report
+    is sent in one piece; in auto mode it replaces an LLM report that fails
+    or sends no text within LLM_REPORT_BUDGET_SECONDS.
+    
+    Events, in order:
+        profile: customer profile
+        recommendations: scored opportunities
+        summary: opportunity summary
+        report: {"text": ...} for each chunk of the research report
+        done: {"customer_id", "timestamp", "report_length", "report_source"}
+        error: {"detail": ...} if processing fails mid-stream
+    """
+    from agents import stream_report_async
+    
+    snapshot = get_snapshot()
+    customer_id = validate_customer_request(snapshot, customer_id)
+    mode = report_mode or REPORT_MODE
+    
+    async def events():
+        try:
+            result = await snapshot.ainvoke({"customer_id": customer_id}, include_report=False)
+            opportunities = result.get('scored_opportunities', [])
+            yield sse_event("profile", result['customer_profile'])
+            yield sse_event("recommendations", opportunities)
+            yield sse_event("summary", summarize_opportunities(opportunities))
+            
+            analysis = (result['customer_profile'], result['pattern_analysis'], result['affinity_analysis'], opportunities)
+            report_length = 0
+            report_source = "template"
+            async for text, report_source in stream_report_async(*analysis, mode=mode):
+                report_length += len(text)
+                yield sse_event("report", {"text": text})
+            
+            yield sse_event("done", {
+                "customer_id": customer_id,
+                "timestamp": datetime.now().isoformat(),
+                "report_length": report_length,
+                "report_source": report_source
+            })
+        except Exception as e:
+            print(f"Error streaming analysis for customer {customer_id}: {e}")
+            traceback.print_exc()
+            yield sse_event("error", {"detail": f"Processing error: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/recommendations/batch")
+async def get_recommendations_batch(request: BatchRecommendationRequest):
+    """
+    Get recommendations and research reports for many customers in one call.
+
+    Opportunities for the whole batch are scored in one vectorized pass, and
+    research reports are generated with bounded concurrency. Each customer gets
+    its own result entry; a failure for one customer is reported on that entry
+    instead of failing the batch.
+    
+    Args:
+        request: Customer IDs plus include_profile / include_report flags
+    
+    Returns:
+        JSON with one result per requested customer, in request order
+    """
+    from agents import (
+        customer_context_agent,
+        purchase_pattern_agent,
+        product_affinity_agent,
+        generate_report_async,
+        score_all_customers,
+        opportunities_by_customer
+    )
+    
+    snapshot = get_snapshot()
+    customer_data = snapshot.customer_data
+    
+    if not request.customer_ids:
+        raise HTTPException(status_code=400, detail="At least one customer ID is required")
+    
+    if len(request.customer_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Batch too large: {len(request.customer_ids)} customers requested, maximum is {MAX_BATCH_SIZE}"
+        )
+    
+    index = snapshot.index
+    
+    # Normalize IDs, keeping request order and dropping duplicates
+    customer_ids = list(dict.fromkeys(customer_id.strip().upper() for customer_id in request.customer_ids))
+    known_ids = [customer_id for customer_id in customer_ids if customer_id and customer_id in index]
+    
+    # Score the whole batch in one pass
+    try:
+        scores = await run_in_threadpool(score_all_customers, customer_data, known_ids)
+        opportunities = opportunities_by_customer(scores)
+    except Exception as e:
+        print(f"Error scoring batch: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+    
+    def analyze(customer_id: str) -> Dict[str, Any]:
+        profile = customer_context_agent(customer_id, customer_data)
+        analysis = {"profile": profile}
+        if request.include_report:
+            analysis["pattern"] = purchase_pattern_agent(profile, customer_data)
+            analysis["affinity"] = product_affinity_agent(profile, customer_data)
+        return analysis
+    
+    # Bounds this batch's share of the global LLM concurrency limit
+    report_slots = asyncio.Semaphore(max(1, BATCH_REPORT_CONCURRENCY))
+    
+    async def process(customer_id: str) -> Dict[str, Any]:
+        try:
+            if not customer_id:
+                return {"customer_id": customer_id, "status": "error", "status_code": 400, "error": "Customer ID is required"}
+            if customer_id not in index:
+                return {"customer_id": customer_id, "status": "error", "status_code": 404, "error": f"Customer {customer_id} not found"}
+            
+            recommendations = opportunities.get(customer_id, [])
+            analysis = await run_in_threadpool(analyze, customer_id)
+            item = {
+                "customer_id": customer_id,
+                "status": "ok",
+                "research_report": '',
+                "recommendations": recommendations,
+                "summary": summarize_opportunities(recommendations)
+            }
+            if request.include_report:
+                async with report_slots:
+                    item["research_report"], item["report_source"] = await generate_report_async(
+                        analysis["profile"], analysis["pattern"], analysis["affinity"], recommendations,
+                        mode=request.report_mode, interactive=False
+                    )
+            if request.include_profile:
+                item["customer_profile"] = analysis["profile"]
+            return item
+        except Exception as e:
+            print(f"Error processing batch item for customer {customer_id}: {e}")
+            traceback.print_exc()
+            return {"customer_id": customer_id, "status": "error", "status_code": 500, "error": f"Processing error: {str(e)}"}
+    
+    results = await asyncio.gather(*(process(customer_id) for customer_id in customer_ids))
+    
+    succeeded = len([r for r in results if r['status'] == 'ok'])
+    return JSONResponse({
+        "timestamp": datetime.now().isoformat(),
+        "pipeline_type": "LangGraph",
+        "results": results,
+        "summary": {
+            "requested": len(customer_ids),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
+        }
+    })
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {
+    snapshot = current_snapshot
+    health = {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "pipeline_ready": pipeline is not None,
-        "data_loaded": customer_data is not None and not customer_data.empty,
+        "pipeline_ready": snapshot is not None,
+        "data_loaded": snapshot is not None,
         "pipeline_type": "LangGraph",
-        "available_customers": len(customer_data['Customer_ID'].unique()) if customer_data is not None else 0
+        "available_customers": len(snapshot.index) if snapshot is not None else 0,
+        "data_version": snapshot.version if snapshot is not None else None,
+        "data_source": snapshot.source if snapshot is not None else None,
+        "data_loaded_at": snapshot.created_at if snapshot is not None else None,
+        "live_snapshots": len(live_snapshots),
+        "report_cache": get_report_cache().stats() if get_report_cache() is not None else None,
+        "llm_scheduler": get_llm_scheduler().stats(),
+        "precomputed_results": recommendation_store.stats() if recommendation_store is not None else None
     }
+    # The cache and scheduler counters move on almost every request, so the
+    # report is never cached or answered with 304
+    return JSONResponse({"status": health["status"], "timestamp": datetime.now().isoformat(), **health},
+                        headers={"Cache-Control": "no-store"})
 
 @app.get("/customers")
-def get_customers():
-    """Get list of available customers"""
-    if customer_data is None or customer_data.empty:
+def get_customers(
+    limit: int = Query(CUSTOMERS_PAGE_SIZE, ge=1, le=MAX_CUSTOMERS_PAGE_SIZE, description="Number of customers to return"),
+    offset: int = Query(0, ge=0, description="Number of customers to skip"),
+    sort_by: str = Query("customer_id", description="customer_id, company_name, industry, priority_rating or total_spent"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="Sort direction"),
+    industry: Optional[str] = Query(None, description="Only customers in this industry"),
+    priority_rating: Optional[str] = Query(None, description="Only customers with this priority rating"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previous response, answered with 304 if unchanged")
+):
+    """Get a page of available customers from the snapshot's customer summary"""
+    snapshot = current_snapshot
+    if snapshot is None:
         raise HTTPException(status_code=503, detail="Data not loaded")
     
-    customers = []
-    for customer_id in sorted(customer_data['Customer_ID'].unique()):
-        customer_info = customer_data[customer_data['Customer_ID'] == customer_id].iloc[0]
-        customers.append({
-            "customer_id": customer_id,
-            "company_name": customer_info.get('Customer_Name', ''),
-            "industry": customer_info.get('Industry', ''),
-            "priority_rating": customer_info.get('Customer_Priority_Rating', ''),
-            "total_spent": float(customer_data[customer_data['Customer_ID'] == customer_id]['Total_Price(USD)'].sum())
-        })
+    # Reject a bad sort column before the ETag check so a wildcard
+    # If-None-Match cannot turn a 400 into a 304
+    if sort_by not in CustomerSummary.SORT_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot sort by {sort_by!r}; expected one of {', '.join(CustomerSummary.SORT_COLUMNS)}"
+        )
     
-    return {
+    etag = snapshot_etag(snapshot, "customers", limit, offset, sort_by, order, industry, priority_rating)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    try:
+        customers, total_count = snapshot.index.summary.page(
+            offset=offset,
+            limit=limit,
+            sort_by=sort_by,
+            descending=order == "desc",
+            filters={"industry": industry, "priority_rating": priority_rating}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JSONResponse({
         "customers": customers,
-        "total_count": len(customers),
+        "total_count": total_count,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < total_count else None,
+        "timestamp": datetime.now().isoformat()
+    }, headers=cache_headers(etag))
+
+@app.get("/similar")
+def get_similar_customers(
+    customer_id: str = Query(..., description="Customer ID to find lookalikes for (e.g., C001)"),
+    k: int = Query(10, ge=1, le=MAX_SIMILAR_CUSTOMERS, description="Number of lookalike customers to return"),
+    if_none_match: Optional[str] = Header(None, description="ETag of a previous response, answered with 304 if unchanged")
+):
+    """
+    Nearest lookalike customers by revenue, employees, product usage,
+    priority, account type and products bought, closest first
+    """
+    snapshot = get_snapshot()
+    customer_id = validate_customer_request(snapshot, customer_id)
+    etag = snapshot_etag(snapshot, "similar", customer_id, k)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    index = snapshot.index
+    neighbors = index.similarity.neighbors(customer_id, k)
+    customers = index.customer_attributes([index.code(neighbor) for neighbor in neighbors.index])
+    customers = customers.astype(object).where(customers.notna(), '')
+    similar = [
+        {
+            "customer_id": neighbor,
+            "company_name": customer.get('Customer_Name', ''),
+            "industry": customer.get('Industry', ''),
+            "priority_rating": customer.get('Customer_Priority_Rating', ''),
+            "distance": float(distance),
+        }
+        for (neighbor, distance), customer in zip(neighbors.items(), customers.to_dict('records'))
+    ]
+    return JSONResponse({
+        "customer_id": customer_id,
+        "similar_customers": similar,
+        "k": k,
+        "timestamp": datetime.now().isoformat()
+    }, headers=cache_headers(etag))
+
+@app.get("/metrics")
+def get_metrics():
+    """Pipeline, LLM and HTTP metrics in the Prometheus text format"""
+    if not metrics_enabled():
+        raise HTTPException(status_code=404, detail="Metrics are disabled (install prometheus_client and set METRICS_ENABLED)")
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
+@app.post("/ingest")
+def ingest_data():
+    """Ingest rows appended to the data file since it was last read"""
+    if data_feed is None or current_snapshot is None:
+        raise HTTPException(status_code=503, detail="Data not loaded")
+    try:
+        new_records = data_feed.poll(publish_snapshot)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ingest error: {str(e)}")
+    snapshot = current_snapshot
+    return {
+        "status": "success",
+        "new_records": new_records,
+        "total_records": len(snapshot.customer_data),
+        "data_version": snapshot.version,
         "timestamp": datetime.now().isoformat()
     }
 
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Precompute recommendations for every customer in the data file.
+
+    python materialize.py                      # scores for every customer
+    python materialize.py --reports            # and LLM research reports
+    python materialize.py --workers 8 --store .cache/recommendations.sqlite
+
+Results go to a SQLite store, tagged with the data file version they were
+computed from. With PRECOMPUTED_RESULTS_PATH set, the API serves them
+while the data is unchanged and computes anything else live.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class RecommendationStore:
+    """
+    SQLite store of precomputed pipeline results, one row per customer.
+
+    Each row keeps the customer's profile, pattern and affinity analysis,
+    scored opportunities and, when generated, the research report, along
+    with the data file fingerprint it was computed from and when.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            "customer_id TEXT PRIMARY KEY, data_source TEXT, computed_at REAL, result TEXT)"
+        )
+        self._db.commit()
+
+    def get(self, customer_id: str) -> Optional[Dict[str, Any]]:
+        """The stored entry for a customer (result, data_source, computed_at), or None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, data_source, computed_at FROM recommendations WHERE customer_id = ?",
+                (customer_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        result, data_source, computed_at = row
+        return {"result": json.loads(result), "data_source": data_source, "computed_at": computed_at}
+
+    def put_many(self, entries: List[Dict[str, Any]], data_source: str):
+        """Store results, given as dicts with customer_id and the pipeline outputs"""
+        now = time.time()
+        rows = [(entry["customer_id"], data_source, now, json.dumps(entry, default=_json_default)) for entry in entries]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO recommendations (customer_id, data_source, computed_at, result) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+
+    def prune(self, keep_customers: List[str]):
+        """Drop customers that are no longer in the data"""
+        with self._lock:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (customer_id TEXT PRIMARY KEY)")
+            self._db.execute("DELETE FROM keep")
+            self._db.executemany("INSERT OR IGNORE INTO keep VALUES (?)", [(c,) for c in keep_customers])
+            self._db.execute("DELETE FROM recommendations WHERE customer_id NOT IN (SELECT customer_id FROM keep)")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, oldest, newest = self._db.execute(
+                "SELECT COUNT(*), MIN(computed_at), MAX(computed_at) FROM recommendations"
+            ).fetchone()
+            sources = self._db.execute(
+                "SELECT data_source, COUNT(*) FROM recommendations GROUP BY data_source"
+            ).fetchall()
+        return {
+            "path": self.path,
+            "entries": count,
+            "oldest_computed_at": oldest,
+            "newest_computed_at": newest,
+            "entries_by_data_source": dict(sources),
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def _json_default(value):
+    # Analysis results hold numpy scalars from pandas aggregations
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+# --- Materialization job ---
+# Each worker process analyses customers against its own copy of the data.
+# Under fork the copy loaded by the parent is inherited without reloading.
+_worker_data = None
+_worker_pipeline_graph = None
+
+def _init_worker(csv_path: str, workers: int):
+    global _worker_data
+    # Every process has its own LLM scheduler, so each gets its share of
+    # the rate limits rather than the whole of them
+    from llm_scheduler import share_llm_budget
+    share_llm_budget(workers)
+    if _worker_data is None:
+        from data_loader import load_customer_data
+        _worker_data = load_customer_data(csv_path)
+
+def _worker_pipeline():
+    """The analysis pipeline over the worker's data, built on first use"""
+    global _worker_pipeline_graph
+    if _worker_pipeline_graph is None:
+        from pipeline import build_pipeline
+        _worker_pipeline_graph = build_pipeline(_worker_data, include_report=False)
+    return _worker_pipeline_graph
+
+def analyse_customers(customer_ids: List[str], include_reports: bool = False) -> Dict[str, Any]:
+    """
+    Run each customer through the analysis pipeline against the worker's
+    data, adding the LLM report when asked. Returns the results plus the
+    IDs that failed with their errors.
+    """
+    from agents import generate_report, REPORT_FAILURE_PREFIX
+    pipeline = _worker_pipeline()
+    results, errors = [], {}
+    for customer_id in customer_ids:
+        try:
+            result = pipeline.invoke({"customer_id": customer_id})
+            analysis = (result["customer_profile"], result["pattern_analysis"], result["affinity_analysis"],
+                        result["scored_opportunities"])
+            report = generate_report(*analysis, mode="llm", interactive=False)[0] if include_reports else None
+            if report is not None and report.startswith(REPORT_FAILURE_PREFIX):
+                # Left for the API to generate on request rather than stored as the report
+                errors[customer_id] = report
+                report = None
+            results.append({
+                "customer_id": result["customer_profile"]["customer_id"],
+                "customer_profile": result["customer_profile"],
+                "pattern_analysis": result["pattern_analysis"],
+                "affinity_analysis": result["affinity_analysis"],
+                "scored_opportunities": result["scored_opportunities"],
+                "research_report": report,
+            })
+        except Exception as e:
+            errors[customer_id] = str(e)
+    return {"results": results, "errors": errors}
+
+def materialize(csv_path: str, store_path: str, workers: Optional[int] = None, include_reports: bool = False,
+                chunk_size: int = 500, customer_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Compute and store results for every customer (or `customer_ids`) in
+    `csv_path`, spread over `workers` processes. Returns a run summary.
+    """
+    global _worker_data, _worker_pipeline_graph
+    from data_loader import load_customer_data, get_customer_index, file_fingerprint
+
+    started = time.time()
+    data_source = file_fingerprint(csv_path)
+    _worker_data = load_customer_data(csv_path)
+    _worker_pipeline_graph = None
+    index = get_customer_index(_worker_data)
+    # Built once here so forked workers share them instead of each building its own
+    index.cooccurrence
+    index.aggregates
+    targets = list(customer_ids) if customer_ids else list(index.customer_ids)
+    chunks = [targets[i:i + chunk_size] for i in range(0, len(targets), chunk_size)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks) or 1))
+
+    store = RecommendationStore(store_path)
+    stored, errors = 0, {}
+    print(f"🏭 Materializing {len(targets)} customers with {workers} worker(s)"
+          f"{' including reports' if include_reports else ''}")
+    try:
+        if workers == 1:
+            outputs = (analyse_customers(chunk, include_reports) for chunk in chunks)
+            for output in outputs:
+                store.put_many(output["results"], data_source)
+                stored += len(output["results"])
+                errors.update(output["errors"])
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(csv_path, workers)) as pool:
+                futures = [pool.submit(analyse_customers, chunk, include_reports) for chunk in chunks]
+                for done, future in enumerate(as_completed(futures), 1):
+                    output = future.result()
+                    store.put_many(output["results"], data_source)
+                    stored += len(output["results"])
+                    errors.update(output["errors"])
+                    if done % max(1, len(futures) // 10) == 0:
+                        print(f"   {stored}/{len(targets)} customers stored")
+        if not customer_ids:
+            store.prune(index.customer_ids)
+    finally:
+        store.close()
+
+    summary = {
+        "data_source": data_source,
+        "store": store_path,
+        "customers": len(targets),
+        "stored": stored,
+        "errors": errors,
+        "include_reports": include_reports,
+        "seconds": time.time() - started,
+    }
+    print(f"✅ Stored {stored} of {len(targets)} customers in {summary['seconds']:.1f}s"
+          f"{f' ({len(errors)} with errors)' if errors else ''}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', default=os.getenv('CSV_PATH', 'customer_data.csv'), help='Data file (default: CSV_PATH)')
+    parser.add_argument('--store', default=os.getenv('PRECOMPUTED_RESULTS_PATH') or os.path.join('.cache', 'recommendations.sqlite'),
+                        help='SQLite store to write (default: PRECOMPUTED_RESULTS_PATH)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--reports', action='store_true', help='Also generate research reports with the LLM')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Customers per worker task')
+    parser.add_argument('--customers', nargs='*', help='Only these customer IDs')
+    args = parser.parse_args(argv)
+
+    # The store replaces the report cache for this job, and worker processes
+    # would contend for its SQLite file
+    os.environ['REPORT_CACHE_ENABLED'] = 'false'
+    summary = materialize(args.csv, args.store, workers=args.workers, include_reports=args.reports,
+                          chunk_size=args.chunk_size, customer_ids=args.customers)
+    return 1 if summary["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
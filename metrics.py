@@ -0,0 +1,146 @@
+import functools
+import inspect
+import os
+import time
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import prometheus_client
+except ImportError:  # metrics are optional; without the package nothing is recorded
+    prometheus_client = None
+
+def metrics_enabled() -> bool:
+    return prometheus_client is not None and os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Latency buckets from sub-millisecond pandas lookups up to slow LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+if prometheus_client is not None:
+    from prometheus_client import Counter, Gauge, Histogram
+
+    NODE_DURATION = Histogram(
+        'pipeline_node_duration_seconds', 'Wall-clock time of a pipeline node',
+        ['node', 'status'], buckets=LATENCY_BUCKETS
+    )
+    # What a record is depends on the node; see node_records in pipeline.py
+    NODE_RECORDS = Histogram(
+        'pipeline_node_records', 'Size of a pipeline node\'s input or output, in node-specific units',
+        ['node'], buckets=SIZE_BUCKETS
+    )
+    LLM_DURATION = Histogram(
+        'llm_request_duration_seconds', 'Latency of report completions',
+        ['mode', 'status'], buckets=LATENCY_BUCKETS
+    )
+    LLM_REQUESTS = Counter(
+        'llm_requests_total', 'Report completions by outcome (success, error or cached)',
+        ['mode', 'status']
+    )
+    LLM_PROMPT_CHARS = Histogram(
+        'llm_prompt_chars', 'Size of report prompts in characters',
+        buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000)
+    )
+    LLM_PROMPT_TOKENS = Counter('llm_prompt_tokens_total', 'Prompt tokens reported by the LLM API')
+    LLM_COMPLETION_TOKENS = Counter('llm_completion_tokens_total', 'Completion tokens reported by the LLM API')
+    HTTP_DURATION = Histogram(
+        'http_request_duration_seconds', 'Time until the response starts, by route',
+        ['method', 'path', 'status'], buckets=LATENCY_BUCKETS
+    )
+    HTTP_IN_PROGRESS = Gauge(
+        'http_requests_in_progress', 'Requests being handled, by route',
+        ['method', 'path']
+    )
+
+def observe_node(node: str, status: str, seconds: float, records: Optional[int] = None):
+    if not metrics_enabled():
+        return
+    NODE_DURATION.labels(node, status).observe(seconds)
+    if records is not None:
+        NODE_RECORDS.labels(node).observe(records)
+
+def timed_node(name: str, fn: Callable, records: Optional[Callable[[Dict], int]] = None) -> Callable:
+    """
+    Wrap a pipeline node so each run records its duration and outcome, plus
+    the node's `records(output)` when given. Works for sync and async nodes.
+    """
+    def finish(started, output=None, error=False):
+        count = None
+        if output is not None and records is not None:
+            try:
+                count = records(output)
+            except Exception:
+                pass
+        observe_node(name, 'error' if error else 'success', time.perf_counter() - started, count)
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def run_async(state):
+            started = time.perf_counter()
+            try:
+                output = await fn(state)
+            except Exception:
+                finish(started, error=True)
+                raise
+            finish(started, output)
+            return output
+        return run_async
+
+    @functools.wraps(fn)
+    def run(state):
+        started = time.perf_counter()
+        try:
+            output = fn(state)
+        except Exception:
+            finish(started, error=True)
+            raise
+        finish(started, output)
+        return output
+    return run
+
+def observe_llm_call(mode: str, status: str, prompt: str, seconds: Optional[float] = None, usage=None):
+    """
+    Record one report completion. `usage` is the token usage object of the
+    API response, when the API returned one.
+    """
+    if not metrics_enabled():
+        return
+    LLM_REQUESTS.labels(mode, status).inc()
+    LLM_PROMPT_CHARS.observe(len(prompt))
+    if seconds is not None:
+        LLM_DURATION.labels(mode, status).observe(seconds)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.inc(getattr(usage, 'prompt_tokens', 0) or 0)
+        LLM_COMPLETION_TOKENS.inc(getattr(usage, 'completion_tokens', 0) or 0)
+
+def _route_path(request) -> str:
+    # Label by route template, not the raw URL, to keep label values bounded
+    from starlette.routing import Match
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
+
+async def metrics_middleware(request, call_next):
+    """HTTP middleware recording request latency and in-flight requests per route"""
+    if not metrics_enabled():
+        return await call_next(request)
+    path = _route_path(request)
+    in_progress = HTTP_IN_PROGRESS.labels(request.method, path)
+    in_progress.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        in_progress.dec()
+        HTTP_DURATION.labels(request.method, path, str(status)).observe(time.perf_counter() - started)
+
+def render_metrics():
+    """Current metrics in the Prometheus text format, with its content type"""
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -1,12 +1,20 @@
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
 from agents import (
     customer_context_agent,
     purchase_pattern_agent,
     product_affinity_agent,
     opportunity_scoring_agent,
-    recommendation_report_agent
+    generate_report,
+    generate_report_async
 )
-from typing import Dict, TypedDict
+from data_loader import get_customer_index
+from metrics import timed_node
+from profiling import profiled_node
+from contextlib import contextmanager
+from typing import Dict, Optional, TypedDict
+import contextvars
+import threading
 import pandas as pd
 
 class AgentState(TypedDict):
@@ -16,61 +24,158 @@ class AgentState(TypedDict):
     affinity_analysis: Dict
     scored_opportunities: list
     research_report: str
+    # Optional input: "template", "llm" or "auto" (default REPORT_MODE)
+    report_mode: str
+    # Output: "template" or "llm", whichever produced research_report
+    report_source: str
+    # Optional input: also look for gaps among this many lookalike customers
+    lookalikes: int
 
-def build_pipeline(customer_data: pd.DataFrame):
+# Data a pipeline built without its own runs against, set per run with
+# pipeline_data. Nodes see it because runs copy the caller's context.
+_run_data = contextvars.ContextVar('pipeline_data', default=None)
+
+@contextmanager
+def pipeline_data(customer_data: pd.DataFrame):
+    """Run shared pipelines invoked inside this block against `customer_data`"""
+    token = _run_data.set(customer_data)
+    try:
+        yield
+    finally:
+        _run_data.reset(token)
+
+def build_pipeline(customer_data: Optional[pd.DataFrame] = None, include_report: bool = True):
+    """
+    Build the analysis graph over a loaded customer DataFrame, or with no
+    DataFrame a graph that runs against the one set by pipeline_data, so it
+    can be shared by every version of the data. With include_report=False
+    the graph stops after scoring, for callers that stream the report
+    themselves.
+
+    Pattern and affinity analysis only read the customer profile, so they
+    run as parallel branches after context and join at scoring. Each node
+    returns only the keys it writes, which lets LangGraph merge the
+    branches without one overwriting the other.
+    """
     workflow = StateGraph(AgentState)
 
+    if customer_data is not None:
+        # Build the indexes up front instead of on the first request. This
+        # also keeps the parallel branches from racing to build them.
+        index = get_customer_index(customer_data)
+        index.cooccurrence
+        index.aggregates
+
+    def data() -> pd.DataFrame:
+        frame = customer_data if customer_data is not None else _run_data.get()
+        if frame is None:
+            raise RuntimeError("Pipeline built without data was run outside pipeline_data()")
+        return frame
+
     # Step 1: Customer Context
-    def context_node(state: AgentState) -> AgentState:
-        profile = customer_context_agent(state['customer_id'], customer_data)
+    def context_node(state: AgentState) -> Dict:
+        profile = customer_context_agent(state['customer_id'], data())
         if not profile:
             raise ValueError(f"Customer {state['customer_id']} not found")
-        return {**state, 'customer_profile': profile}
+        return {'customer_profile': profile}
 
-    # Step 2: Purchase Pattern
-    def pattern_node(state: AgentState) -> AgentState:
-        pattern = purchase_pattern_agent(state['customer_profile'], customer_data)
-        return {**state, 'pattern_analysis': pattern}
+    # Step 2a: Purchase Pattern
+    def pattern_node(state: AgentState) -> Dict:
+        pattern = purchase_pattern_agent(state['customer_profile'], data(), state.get('lookalikes'))
+        return {'pattern_analysis': pattern}
 
-    # Step 3: Product Affinity
-    def affinity_node(state: AgentState) -> AgentState:
-        affinity = product_affinity_agent(state['customer_profile'], customer_data)
-        return {**state, 'affinity_analysis': affinity}
+    # Step 2b: Product Affinity
+    def affinity_node(state: AgentState) -> Dict:
+        affinity = product_affinity_agent(state['customer_profile'], data())
+        return {'affinity_analysis': affinity}
 
-    # Step 4: Opportunity Scoring
-    def scoring_node(state: AgentState) -> AgentState:
+    # Step 3: Opportunity Scoring
+    def scoring_node(state: AgentState) -> Dict:
         scored = opportunity_scoring_agent(
             state['customer_profile'],
             state['pattern_analysis'],
             state['affinity_analysis']
         )
-        return {**state, 'scored_opportunities': scored}
+        return {'scored_opportunities': scored}
+
+    # Step 4: Recommendation Report
+    def report_node(state: AgentState) -> Dict:
+        report, source = generate_report(
+            state['customer_profile'],
+            state['pattern_analysis'],
+            state['affinity_analysis'],
+            state['scored_opportunities'],
+            mode=state.get('report_mode')
+        )
+        return {'research_report': report, 'report_source': source}
 
-    # Step 5: Recommendation Report
-    def report_node(state: AgentState) -> AgentState:
-        report = recommendation_report_agent(
+    # Used instead of report_node under ainvoke, so the LLM call does not
+    # hold a worker thread
+    async def report_node_async(state: AgentState) -> Dict:
+        report, source = await generate_report_async(
             state['customer_profile'],
             state['pattern_analysis'],
             state['affinity_analysis'],
-            state['scored_opportunities']
+            state['scored_opportunities'],
+            mode=state.get('report_mode')
         )
-        return {**state, 'research_report': report}
+        return {'research_report': report, 'report_source': source}
+
+    # Record counts for the pipeline_node_records metric. Each node counts
+    # in its own unit: context the customer's purchase rows, pattern the
+    # other accounts in the customer's industry, affinity the accounts that bought
+    # one of the customer's products, scoring the opportunities scored.
+    # Nodes are also measured stage by stage in profiled runs.
+    node_records = {
+        "context": lambda output: output['customer_profile']['purchase_frequency'],
+        "pattern": lambda output: output['pattern_analysis']['total_industry_customers'],
+        "affinity": lambda output: output['affinity_analysis']['related_customer_count'],
+        "scoring": lambda output: len(output['scored_opportunities']),
+    }
+    def timed(name, node):
+        return timed_node(name, profiled_node(name, node), node_records.get(name))
+
+    # Independent stages that fan out after context and join at scoring
+    analysis_nodes = {
+        "pattern": pattern_node,
+        "affinity": affinity_node,
+    }
 
     # Add nodes to graph
-    workflow.add_node("context", context_node)
-    workflow.add_node("pattern", pattern_node)
-    workflow.add_node("affinity", affinity_node)
-    workflow.add_node("scoring", scoring_node)
-    workflow.add_node("report", report_node)
+    workflow.add_node("context", timed("context", context_node))
+    for name, node in analysis_nodes.items():
+        workflow.add_node(name, timed(name, node))
+    workflow.add_node("scoring", timed("scoring", scoring_node))
+    if include_report:
+        workflow.add_node("report", RunnableLambda(
+            timed("report", report_node), afunc=timed("report", report_node_async), name="report"
+        ))
 
     # Define edges
-    workflow.add_edge("context", "pattern")
-    workflow.add_edge("pattern", "affinity")
-    workflow.add_edge("affinity", "scoring")
-    workflow.add_edge("scoring", "report")
-    workflow.add_edge("report", END)
+    for name in analysis_nodes:
+        workflow.add_edge("context", name)
+    # Scoring waits for every branch to finish
+    workflow.add_edge(list(analysis_nodes), "scoring")
+    if include_report:
+        workflow.add_edge("scoring", "report")
+        workflow.add_edge("report", END)
+    else:
+        workflow.add_edge("scoring", END)
 
     # Set entry point
     workflow.set_entry_point("context")
 
-    return workflow.compile() 
\ No newline at end of file
+    return workflow.compile()
+
+_shared_pipelines = {}
+_shared_lock = threading.Lock()
+
+def get_shared_pipeline(include_report: bool = True):
+    """
+    Process-wide pipeline that runs against the data set by pipeline_data,
+    built once and reused for every version of the data
+    """
+    with _shared_lock:
+        if include_report not in _shared_pipelines:
+            _shared_pipelines[include_report] = build_pipeline(include_report=include_report)
+        return _shared_pipelines[include_report]
@@ -0,0 +1,156 @@
+import contextvars
+import cProfile
+import functools
+import inspect
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Where dumped profiles are written, and how many hot functions a report lists
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join('.cache', 'profiles'))
+PROFILE_TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', '20'))
+
+class ProfilerBusy(RuntimeError):
+    """Raised when another profiled run is in progress"""
+
+class RequestProfile:
+    """
+    Per-stage measurements of one profiled pipeline run.
+
+    Each stage is profiled with its own cProfile profiler on the thread it
+    runs on, so stages that LangGraph runs in worker threads are covered.
+    Their stats are merged into one set for the hot function list and the
+    dump. Memory is measured with tracemalloc. Stages that run in parallel
+    overlap, so their peaks can include each other's allocations.
+    """
+
+    def __init__(self):
+        self.stages: List[Dict] = []
+        self.stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def add_stage(self, name: str, seconds: float, allocated: int, peak: int, profiler: Optional[cProfile.Profile]):
+        with self._lock:
+            self.stages.append({
+                "stage": name,
+                "seconds": seconds,
+                "memory_allocated_bytes": allocated,
+                "memory_peak_bytes": peak,
+            })
+            if profiler is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+
+    def hot_functions(self, limit: int = PROFILE_TOP_FUNCTIONS) -> List[Dict]:
+        """Functions with the most time spent in their own code"""
+        if self.stats is None:
+            return []
+        entries = sorted(self.stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+        return [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "own_seconds": own_time,
+                "cumulative_seconds": cumulative_time,
+            }
+            for (filename, line, name), (_, calls, own_time, cumulative_time, _) in entries
+        ]
+
+_active_profile: contextvars.ContextVar = contextvars.ContextVar('active_profile', default=None)
+# tracemalloc is process-wide, so one profiled run at a time
+_profile_lock = threading.Lock()
+
+def _stage_start() -> Tuple[float, int]:
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    return time.perf_counter(), current
+
+def _stage_end(profile: RequestProfile, name: str, started: Tuple[float, int], profiler=None):
+    start_time, start_memory = started
+    current, peak = tracemalloc.get_traced_memory()
+    profile.add_stage(name, time.perf_counter() - start_time, current - start_memory,
+                      max(peak - start_memory, 0), profiler)
+
+def profiled_node(name: str, fn: Callable) -> Callable:
+    """
+    Wrap a pipeline node so it is measured when it runs inside profile_run.
+    Outside a profiled run the node is called directly.
+    """
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def run_async(state):
+            profile = _active_profile.get()
+            if profile is None:
+                return await fn(state)
+            # Not CPU-profiled: a profiler enabled here would also record
+            # everything else the event loop runs while this stage awaits
+            started = _stage_start()
+            try:
+                return await fn(state)
+            finally:
+                _stage_end(profile, name, started)
+        return run_async
+
+    @functools.wraps(fn)
+    def run(state):
+        profile = _active_profile.get()
+        if profile is None:
+            return fn(state)
+        profiler = cProfile.Profile()
+        started = _stage_start()
+        profiler.enable()
+        try:
+            return fn(state)
+        finally:
+            profiler.disable()
+            _stage_end(profile, name, started, profiler)
+    return run
+
+def profile_run(fn: Callable, *args, dump_name: Optional[str] = None) -> Tuple[object, Dict]:
+    """
+    Call `fn(*args)` with profiling on for the nodes it runs and return its
+    result along with the profile report. With `dump_name`, the merged
+    profile is also written to PROFILE_DIR in pstats format, for viewers
+    such as snakeviz or for conversion to a flame graph.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another profiled request is in progress")
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profile = RequestProfile()
+        token = _active_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        finally:
+            total = time.perf_counter() - started
+            _active_profile.reset(token)
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+
+        report = {
+            "total_seconds": total,
+            "peak_memory_bytes": peak,
+            "stages": profile.stages,
+            "hot_functions": profile.hot_functions(),
+        }
+        if dump_name and profile.stats is not None:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{dump_name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof")
+            profile.stats.dump_stats(path)
+            report["profile_file"] = path
+        return result, report
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+class ReportCache:
+    """
+    Two-tier cache for generated research reports.
+
+    Reports are keyed by a fingerprint of the model, its parameters and the
+    rendered prompt. Lookups go to an in-memory LRU first and then to a SQLite
+    file that survives restarts. Entries expire after `ttl_seconds`, both tiers
+    are size-capped, and entries written for another data snapshot are
+    dropped when the snapshot changes.
+    """
+
+    def __init__(self, path: Optional[str], memory_entries: int = 256, max_entries: int = 10000,
+                 ttl_seconds: float = 86400):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.snapshot = None
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS reports ("
+                "key TEXT PRIMARY KEY, snapshot TEXT, report TEXT, created_at REAL, accessed_at REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, params: Dict[str, Any], prompt: Any) -> str:
+        """Fingerprint of everything that determines the completion"""
+        payload = json.dumps({"model": model, "params": params, "prompt": prompt}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                report, created_at = entry
+                if not self._expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return report
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT report, created_at, snapshot FROM reports WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    report, created_at, snapshot = row
+                    if self._expired(created_at, now):
+                        self._db.execute("DELETE FROM reports WHERE key = ?", (key,))
+                        self._db.commit()
+                    elif snapshot == self.snapshot:
+                        self._db.execute("UPDATE reports SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, report, created_at)
+                        self._counters["disk_hits"] += 1
+                        return report
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, report: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, report, now)
+            self._counters["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO reports (key, snapshot, report, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, self.snapshot, report, now, now)
+                )
+                # Keep the most recently used max_entries rows
+                cursor = self._db.execute(
+                    "DELETE FROM reports WHERE key IN ("
+                    "SELECT key FROM reports ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                self._counters["evictions"] += max(cursor.rowcount, 0)
+                self._db.commit()
+
+    def _remember(self, key: str, report: str, created_at: float):
+        self._memory[key] = (report, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def set_snapshot(self, snapshot: Optional[str]):
+        """Switch to a data snapshot, dropping reports cached for any other one"""
+        with self._lock:
+            if snapshot == self.snapshot:
+                return
+            self.snapshot = snapshot
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM reports WHERE snapshot IS NOT ?", (snapshot,))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM reports")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+            stats["snapshot"] = self.snapshot
+            return stats
+
+_report_cache = None
+_report_cache_lock = threading.Lock()
+
+def get_report_cache() -> Optional[ReportCache]:
+    """
+    Process-wide report cache configured from the environment, or None when
+    REPORT_CACHE_ENABLED is false
+    """
+    global _report_cache
+    if os.getenv('REPORT_CACHE_ENABLED', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _report_cache_lock:
+        if _report_cache is None:
+            _report_cache = ReportCache(
+                os.getenv('REPORT_CACHE_PATH', os.path.join('.cache', 'report_cache.sqlite')) or None,
+                memory_entries=int(os.getenv('REPORT_CACHE_MEMORY_ENTRIES', '256')),
+                max_entries=int(os.getenv('REPORT_CACHE_MAX_ENTRIES', '10000')),
+                ttl_seconds=float(os.getenv('REPORT_CACHE_TTL_SECONDS', '86400')),
+            )
+        return _report_cache
@@ -131,6 +131,39 @@ def test_api():
     except Exception as e:
         print(f"❌ Invalid customer test error: {e}")
     
+    # Test batch recommendations
+    try:
+        print(f"\n📦 Testing batch recommendations")
+        response = requests.post(
+            f"{base_url}/recommendations/batch",
+            json={"customer_ids": [test_customer, "INVALID"], "include_report": False}
+        )
+        if response.status_code == 200:
+            batch_data = response.json()
+            print("✅ Batch recommendations work")
+            print(f"   - Succeeded: {batch_data['summary']['succeeded']}")
+            print(f"   - Failed: {batch_data['summary']['failed']}")
+            for item in batch_data['results']:
+                print(f"   - {item['customer_id']}: {item['status']}")
+        else:
+            print(f"❌ Batch recommendations failed: {response.status_code}")
+    except Exception as e:
+        print(f"❌ Batch recommendations error: {e}")
+    
+    # Test incremental ingest
+    try:
+        print(f"\n➕ Testing incremental ingest")
+        response = requests.post(f"{base_url}/ingest")
+        if response.status_code == 200:
+            ingest_data = response.json()
+            print("✅ Ingest endpoint works")
+            print(f"   - New records: {ingest_data['new_records']}")
+            print(f"   - Total records: {ingest_data['total_records']}")
+        else:
+            print(f"❌ Ingest endpoint failed: {response.status_code}")
+    except Exception as e:
+        print(f"❌ Ingest endpoint error: {e}")
+    
     print("\n🎉 API testing completed successfully!")
     return True
 
@@ -0,0 +1,71 @@
+"""
+Tests for score_all_customers: batch scores have to match the per-customer
+agents, on the sample data and on a synthetic catalogue wide enough that the
+co-purchase counts go through both the subset-sum table and the rare-product
+matrix products.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import agents
+import data_loader
+from data_loader import get_customer_index, load_customer_data_csv
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'customer_data.csv')
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATA_SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+
+
+def write_wide_catalogue(path, customers=1500, products=60, rows=20000, seed=0):
+    """Sample rows relabelled with many accounts and products, each industry preferring its own products"""
+    rng = np.random.default_rng(seed)
+    data = pd.read_csv(SAMPLE_CSV).sample(rows, replace=True, random_state=seed).reset_index(drop=True)
+    industries = data['Industry'].astype('category').cat.codes.to_numpy()
+    preferences = np.array([rng.permutation(products) for _ in range(industries.max() + 1)])
+    weights = 1.0 / np.arange(1, products + 1)
+    data['Customer_ID'] = [f"W{i:05d}" for i in rng.integers(0, customers, rows)]
+    ranks = rng.choice(products, rows, p=weights / weights.sum())
+    data['Product'] = [f"Product {i}" for i in preferences[industries, ranks]]
+    data.to_csv(path, index=False)
+
+
+def per_customer_scores(customer_id, data):
+    profile = agents.customer_context_agent(customer_id, data)
+    return agents.opportunity_scoring_agent(profile, agents.purchase_pattern_agent(profile, data),
+                                            agents.product_affinity_agent(profile, data))
+
+
+def assert_matches_per_customer(data, customer_ids):
+    scored = agents.opportunities_by_customer(agents.score_all_customers(data))
+    for customer_id in customer_ids:
+        assert scored.get(customer_id, []) == per_customer_scores(customer_id, data)
+
+
+def test_sample_data_scores_match_the_agents():
+    data = load_customer_data_csv(SAMPLE_CSV)
+    assert_matches_per_customer(data, get_customer_index(data).customer_ids)
+
+
+@pytest.mark.parametrize('table_cells', [data_loader.RANKING_BLOCK_CELLS, 1 << 12])
+def test_wide_catalogue_scores_match_the_agents(tmp_path, monkeypatch, table_cells):
+    # The second run keeps the subset-sum table to a handful of products,
+    # so most products take the matrix product path, in small blocks
+    monkeypatch.setattr(data_loader, 'RANKING_BLOCK_CELLS', table_cells)
+    path = str(tmp_path / 'wide.csv')
+    write_wide_catalogue(path)
+    data = load_customer_data_csv(path)
+    customer_ids = get_customer_index(data).customer_ids
+    assert_matches_per_customer(data, customer_ids[::15])
+
+    # Requested customers are scored the same as in the full table
+    some = list(np.random.default_rng(0).choice(customer_ids, 40, replace=False))
+    scored = agents.opportunities_by_customer(agents.score_all_customers(data, some))
+    for customer_id in some:
+        assert scored.get(customer_id, []) == per_customer_scores(customer_id, data)
@@ -0,0 +1,123 @@
+"""
+Tests for CustomerDataFeed: data ingested by poll() has to match what a
+full load of the same file produces, down to the derived indexes.
+"""
+
+import csv
+import io
+import os
+
+import pandas as pd
+import pytest
+
+import agents
+from data_loader import CustomerDataFeed, get_customer_index, load_customer_data_csv
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'customer_data.csv')
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATA_SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+
+
+@pytest.fixture
+def sample():
+    with open(SAMPLE_CSV, newline='', encoding='utf-8') as f:
+        header, *rows = list(csv.reader(f))
+    return header, rows
+
+
+def csv_text(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+
+def edited(header, row, **changes):
+    row = list(row)
+    for column, value in changes.items():
+        row[header.index(column)] = value
+    return row
+
+
+def assert_same_analysis(data, expected):
+    """Frame, indexes and agent outputs built incrementally equal those of a full load"""
+    pd.testing.assert_frame_equal(data, expected)
+    assert get_customer_index(data).customer_ids == get_customer_index(expected).customer_ids
+    pd.testing.assert_frame_equal(get_customer_index(data).summary.table, get_customer_index(expected).summary.table,
+                                  check_exact=True)
+    pd.testing.assert_frame_equal(agents.score_all_customers(data), agents.score_all_customers(expected))
+    for customer_id in get_customer_index(expected).customer_ids:
+        profiles = [agents.customer_context_agent(customer_id, frame) for frame in (data, expected)]
+        assert profiles[0] == profiles[1]
+        for agent in (agents.purchase_pattern_agent, agents.product_affinity_agent):
+            assert agent(profiles[0], data) == agent(profiles[1], expected)
+
+
+def test_polled_rows_match_a_full_reload(tmp_path, sample):
+    header, rows = sample
+    path = tmp_path / 'customers.csv'
+    path.write_text(csv_text([header] + rows[:30]), encoding='utf-8')
+    feed = CustomerDataFeed(str(path))
+    # Build the derived tables so polls extend them instead of rebuilding
+    index = get_customer_index(feed.data)
+    index.aggregates, index.cooccurrence, index.summary
+
+    # A customer that sorts between existing ones, another spelling of an
+    # existing account, and a product and industry not seen before
+    appended = rows[30:40] + [
+        edited(header, rows[0], Customer_ID='C0025', Customer_Name='Newco'),
+        edited(header, rows[1], Customer_ID=' c003 '),
+        edited(header, rows[2], Product='Drone Kit', Industry='Aerospace'),
+    ]
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(csv_text(appended))
+    assert feed.poll() == len(appended)
+
+    # A line still being written is left for the next poll
+    last = csv_text(rows[40:])
+    cut = last.index('\n') + 10
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(last[:cut])
+    assert feed.poll() == 1
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(last[cut:])
+    assert feed.poll() == len(rows) - 41
+    assert feed.poll() == 0
+
+    index = get_customer_index(feed.data)
+    assert all(name in index.__dict__ for name in ('aggregates', 'cooccurrence', 'summary'))
+    assert_same_analysis(feed.data, load_customer_data_csv(str(path)))
+
+
+def test_rewritten_file_is_loaded_again_in_full(tmp_path, sample):
+    header, rows = sample
+    path = tmp_path / 'customers.csv'
+    path.write_text(csv_text([header] + rows), encoding='utf-8')
+    feed = CustomerDataFeed(str(path))
+
+    path.write_text(csv_text([header] + rows[10:] + [edited(header, rows[0], Quantity='3')]), encoding='utf-8')
+    assert feed.poll() == len(rows) - 9
+    assert_same_analysis(feed.data, load_customer_data_csv(str(path)))
+
+
+def test_rejected_rows_are_read_again_on_the_next_poll(tmp_path, sample):
+    header, rows = sample
+    path = tmp_path / 'customers.csv'
+    path.write_text(csv_text([header] + rows[:45]), encoding='utf-8')
+    feed = CustomerDataFeed(str(path))
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        f.write(csv_text(rows[45:]))
+
+    def reject(data):
+        raise ValueError("not published")
+
+    with pytest.raises(ValueError):
+        feed.poll(reject)
+    assert len(feed.data) == 45
+
+    published = []
+    assert feed.poll(published.append) == len(rows) - 45
+    assert published[0] is feed.data
+    assert_same_analysis(feed.data, load_customer_data_csv(str(path)))
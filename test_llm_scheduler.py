@@ -0,0 +1,209 @@
+"""
+Tests for the LLM call scheduler: priority order, the concurrency cap, the
+request and token budgets, and cancellation of queued async callers.
+
+Budget tests run on a fake clock that stands in for llm_scheduler's time
+and timer functions, so waits are simulated rather than slept through.
+"""
+
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+
+import llm_scheduler
+from llm_scheduler import (LLMScheduler, PRIORITY_BATCH, PRIORITY_BATCH_HIGH, PRIORITY_INTERACTIVE,
+                           PRIORITY_INTERACTIVE_HIGH)
+
+
+class FakeClock:
+    """monotonic(), sleep() and Timer for the scheduler; time only moves on advance()"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.timers = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def Timer(self, interval, function):
+        timer = types.SimpleNamespace(due=self.now + interval, function=function, daemon=False,
+                                      start=lambda: None)
+        self.timers.append(timer)
+        return timer
+
+    def advance(self, seconds):
+        self.now += seconds
+        due = [timer for timer in self.timers if timer.due <= self.now]
+        self.timers = [timer for timer in self.timers if timer.due > self.now]
+        for timer in due:
+            timer.function()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_scheduler, 'time', clock)
+    monkeypatch.setattr(llm_scheduler, 'threading', types.SimpleNamespace(
+        Lock=threading.Lock, Event=threading.Event, Timer=clock.Timer
+    ))
+    return clock
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the scheduler"
+        time.sleep(0.005)
+
+
+def reserve_in_thread(scheduler, granted, name, priority=PRIORITY_INTERACTIVE, tokens=0, hold=None):
+    """Take a slot in a background thread, record `name` once admitted and keep it until `hold` is set"""
+    def run():
+        with scheduler.reserve(priority, tokens):
+            granted.append(name)
+            if hold is not None:
+                hold.wait()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_queued_calls_are_admitted_by_priority_then_arrival():
+    scheduler = LLMScheduler(max_concurrency=1)
+    granted, threads = [], []
+    with scheduler.reserve():
+        for name, priority in [("batch 1", PRIORITY_BATCH), ("interactive", PRIORITY_INTERACTIVE),
+                               ("batch 2", PRIORITY_BATCH), ("batch high", PRIORITY_BATCH_HIGH),
+                               ("interactive high", PRIORITY_INTERACTIVE_HIGH)]:
+            threads.append(reserve_in_thread(scheduler, granted, name, priority))
+            wait_until(lambda: scheduler.stats()["queued"] == len(threads))
+        assert granted == []
+    for thread in threads:
+        thread.join(5)
+
+    assert granted == ["interactive high", "interactive", "batch high", "batch 1", "batch 2"]
+
+
+def test_calls_in_flight_never_exceed_max_concurrency():
+    scheduler = LLMScheduler(max_concurrency=2)
+    granted, hold = [], threading.Event()
+    threads = [reserve_in_thread(scheduler, granted, i, hold=hold) for i in range(5)]
+    wait_until(lambda: scheduler.stats()["queued"] == 3)
+
+    stats = scheduler.stats()
+    assert (stats["active"], len(granted)) == (2, 2)
+    hold.set()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(granted) == list(range(5))
+    assert scheduler.stats() == {"granted": 5, "retries": 0, "rate_limited": 0, "queued": 0, "active": 0}
+
+
+def test_requests_per_minute_holds_calls_until_the_budget_refills(clock):
+    scheduler = LLMScheduler(max_concurrency=10, requests_per_minute=2)
+    with scheduler.reserve(), scheduler.reserve():
+        pass
+
+    granted = []
+    thread = reserve_in_thread(scheduler, granted, "third")
+    wait_until(lambda: scheduler.stats()["queued"] == 1)
+    # One request comes back every 30 seconds
+    clock.advance(29)
+    assert scheduler.stats()["queued"] == 1
+    clock.advance(1)
+    thread.join(5)
+    assert granted == ["third"]
+
+
+def test_tokens_per_minute_holds_calls_until_the_budget_refills(clock):
+    scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=1000)
+    with scheduler.reserve(estimated_tokens=600):
+        pass
+
+    granted = []
+    thread = reserve_in_thread(scheduler, granted, "second", tokens=600)
+    wait_until(lambda: scheduler.stats()["queued"] == 1)
+    # 400 tokens are left; the missing 200 take 12 seconds to come back
+    clock.advance(11.9)
+    assert scheduler.stats()["queued"] == 1
+    clock.advance(0.1)
+    thread.join(5)
+    assert granted == ["second"]
+
+
+def test_reported_usage_returns_unused_estimated_tokens(clock):
+    scheduler = LLMScheduler(max_concurrency=10, tokens_per_minute=1000)
+    with scheduler.reserve(estimated_tokens=600) as reservation:
+        reservation.used_tokens = 100
+
+    # 900 tokens remain without any time passing, enough for another 600
+    granted = []
+    reserve_in_thread(scheduler, granted, "second", tokens=600).join(5)
+    assert granted == ["second"]
+
+
+def test_cancelled_async_caller_gives_up_its_place_in_the_queue():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def wait_for_slot():
+        async with scheduler.reserve_async():
+            pass
+
+    async def main():
+        async with scheduler.reserve_async():
+            task = asyncio.create_task(wait_for_slot())
+            while scheduler.stats()["queued"] == 0:
+                await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert scheduler.stats()["queued"] == 0
+        # The slot went back to the pool rather than to the cancelled caller
+        assert scheduler.stats()["active"] == 0
+        await asyncio.wait_for(wait_for_slot(), 5)
+
+    asyncio.run(main())
+    assert scheduler.stats() == {"granted": 2, "retries": 0, "rate_limited": 0, "queued": 0, "active": 0}
+
+
+def test_async_caller_cancelled_after_its_grant_releases_the_slot():
+    scheduler = LLMScheduler(max_concurrency=1)
+
+    async def wait_for_slot():
+        async with scheduler.reserve_async():
+            pass
+
+    async def main():
+        with scheduler.reserve():
+            task = asyncio.create_task(wait_for_slot())
+            while scheduler.stats()["queued"] == 0:
+                await asyncio.sleep(0)
+        # Leaving the block granted the slot to the task, which is cancelled
+        # before it gets to run
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.stats()["active"] == 0
+        await asyncio.wait_for(wait_for_slot(), 5)
+
+    asyncio.run(main())
+    assert scheduler.stats() == {"granted": 3, "retries": 0, "rate_limited": 0, "queued": 0, "active": 0}
+
+
+def test_worker_processes_share_the_configured_budgets(monkeypatch):
+    monkeypatch.setenv('LLM_MAX_CONCURRENCY', '16')
+    monkeypatch.setenv('LLM_REQUESTS_PER_MINUTE', '120')
+    monkeypatch.setenv('LLM_TOKENS_PER_MINUTE', '60000')
+    monkeypatch.setattr(llm_scheduler, '_scheduler', None)
+    monkeypatch.setattr(llm_scheduler, '_budget_share', 1)
+
+    llm_scheduler.share_llm_budget(4)
+    scheduler = llm_scheduler.get_llm_scheduler()
+    assert (scheduler.max_concurrency, scheduler.requests_per_minute, scheduler.tokens_per_minute) == (4, 30, 15000)